@@ -743,6 +743,10 @@ async def update_preferences(
                 detail="User not found"
             )
         
+        # Open WebSocket connections reload the new preferences on their next request
+        from app.services.user_context_service import user_context_service
+        user_context_service.invalidate(current_user["id"])
+        
         return {
             "success": True,
             "message": "Preferences updated successfully",
@@ -1062,6 +1066,9 @@ async def delete_all_user_data(
         
         from app.services.email_service import email_service
         from app.services.chat_service import chat_service
+        from app.services.style_profile_service import style_profile_service
+        from app.services.response_cache import email_response_cache
+        from app.services.user_context_service import user_context_service
         from app.services.user_activity_service import user_activity_service
         
         user_id = current_user["id"]
@@ -1072,6 +1079,11 @@ async def delete_all_user_data(
         # Delete all chat messages
         await chat_service.clear_user_messages(db, user_id)
         
+        # Delete the learned writing-style profile
+        await style_profile_service.clear_profile(db, user_id)
+        email_response_cache.invalidate_user(user_id)
+        user_context_service.invalidate(user_id)
+        
         # Delete all activity logs
         await user_activity_service.clear_user_activities(user_id)
         
@@ -1,40 +1,46 @@
 import email
-from app.services.llm_service import llm_service, LLMService
-from app.services.env_vars_service import env_vars_service
+from app.services.llm_service import llm_service, LLMService, GenerationContext, DEFAULT_CONTEXT
 from app.services.user_activity_service import user_activity_service
-from app.models.schemas import ChatMessage as cht, Email as em, ActivityAction, ActivityStatus
+from app.services.stream_pacer import stream_pacer
+from app.services.llm_client_cache import llm_client_cache
+from app.services.api_key_validator import api_key_validator
+from app.services.user_context_service import user_context_service, UserLLMContext
+from app.services.style_index_service import style_index_service
+from app.services.response_cache import email_response_cache
+from app.services.email_stream_parser import EmailStreamParser
+from app.services.conversation_memory import ConversationMemory
+from app.services.llm_scheduler import llm_scheduler, Ticket
+from app.services.email_service import email_service
 from app.core.database import db_manager
+from app.core.config import settings
+from app.models.schemas import ChatMessage as cht, Email as em, ActivityAction, ActivityStatus
+import asyncio
+import dataclasses
 import time
-from typing import Optional
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
 
 
-async def get_user_llm_service(user_id: Optional[str] = None) -> LLMService:
-    """Get an LLM service instance configured with user's API key and preferences."""
+async def get_user_llm_service(user_id: Optional[str] = None,
+                               user_context: Optional[UserLLMContext] = None) -> Tuple[LLMService, GenerationContext]:
+    """Get an LLM service configured with the user's API key, plus their generation context.
+
+    Pass a previously loaded ``user_context`` (e.g. cached on the WebSocket
+    connection) to skip the database round trip entirely.
+    """
     if not user_id:
         # Use default service with system API key
-        return llm_service
+        return llm_service, DEFAULT_CONTEXT
     
     user_api_key = None
-    user_preferences = None
+    context = DEFAULT_CONTEXT
     fetch_error = None
     
     try:
-        # Get database session - fetch both API key and preferences
-        async with db_manager.session_factory() as db:
-            from app.services.auth_service import auth_service
-            
-            # Get user preferences
-            user = await auth_service.get_user_by_id(db, user_id)
-            if user:
-                user_preferences = {
-                    "language": user.language or "English",
-                    "default_tone": user.default_tone or "Professional",
-                    "ai_learning": user.ai_learning or False
-                }
-            
-            # Get API key
-            user_api_key = await env_vars_service.get_decrypted_value(db, user_id, "GOOGLE_API_KEY")
-        # Session is now closed, safe to do everything else
+        # Preferences, API key and style examples arrive in one batch
+        if user_context is None:
+            user_context = await user_context_service.load(user_id)
+        context = user_context.generation_context
+        user_api_key = user_context.api_key
     except Exception as e:
         print(f"Error getting user LLM service: {e}")
         fetch_error = str(e)
@@ -53,43 +59,33 @@ async def get_user_llm_service(user_id: Optional[str] = None) -> LLMService:
         except Exception as log_err:
             print(f"Failed to log activity: {log_err}")
     elif user_api_key:
-        # Try to create service with user's API key
-        user_service = LLMService(api_key=user_api_key)
-        
-        # Set user preferences if available
-        if user_preferences:
-            user_service.set_user_preferences(
-                language=user_preferences["language"],
-                default_tone=user_preferences["default_tone"],
-                ai_learning=user_preferences["ai_learning"]
-            )
+        # Reuse the cached service for this user and key, or build one
+        user_service = llm_client_cache.get_or_create(user_id, user_api_key)
         
         if user_service.is_available():
-            # Test if the API key actually works by attempting a simple request
+            # Keys are validated when saved and re-flagged on auth errors during
+            # generation. Keys with no cached result (saved before validation
+            # existed, or whose entry expired) are probed once here
+            key_status = api_key_validator.get_status(user_api_key)
+            if key_status is None and settings.llm_provider == "gemini":
+                key_status = await api_key_validator.validate(user_api_key)
+            if key_status is not False:
+                return user_service, context
+
+            llm_client_cache.invalidate_user(user_id)
             try:
-                # Try a minimal test to validate the key
-                test_response = user_service.model.generate_content(
-                    "test",
-                    generation_config={"max_output_tokens": 1}
+                await user_activity_service.log_activity(
+                    user_id=user_id,
+                    action=ActivityAction.RESPONSE_GENERATED,
+                    status=ActivityStatus.WARNING,
+                    message="User's GOOGLE_API_KEY is invalid",
+                    details={
+                        "reason": "Invalid or expired API key",
+                        "request": "Please pass a valid API key" 
+                    }
                 )
-                # If we get here, the key is valid
-                return user_service
-            except Exception as validation_error:
-                # API key is invalid or has issues
-                print(f"API key validation failed: {validation_error}")
-                try:
-                    await user_activity_service.log_activity(
-                        user_id=user_id,
-                        action=ActivityAction.RESPONSE_GENERATED,
-                        status=ActivityStatus.WARNING,
-                        message="User's GOOGLE_API_KEY is invalid",
-                        details={
-                            "reason": "Invalid or expired API key",
-                            "request": "Please pass a valid API key" 
-                        }
-                    )
-                except Exception as log_err:
-                    print(f"Failed to log activity: {log_err}")
+            except Exception as log_err:
+                print(f"Failed to log activity: {log_err}")
         else:
             # Model wasn't initialized at all
             try:
@@ -118,19 +114,35 @@ async def get_user_llm_service(user_id: Optional[str] = None) -> LLMService:
         except Exception as log_err:
             print(f"Failed to log activity: {log_err}")
     
-    # Fallback to default service
-    # Even with default service, apply user preferences if available
-    if user_preferences:
-        llm_service.set_user_preferences(
-            language=user_preferences["language"],
-            default_tone=user_preferences["default_tone"],
-            ai_learning=user_preferences["ai_learning"]
-        )
-    
-    return llm_service
+    # Fallback to default service; the user's preferences travel in the context
+    return llm_service, context
 
 
-async def handle_chat_message(data: dict, user_id: Optional[str] = None) -> cht:
+async def queued_frames(ticket: Ticket, request_id: str) -> AsyncGenerator[dict, None]:
+    """Report queue position to the client until the scheduler admits the request."""
+    async for position, waited_ms in ticket.wait():
+        yield {"type": "queued", "request_id": request_id, "position": position, "waited_ms": waited_ms}
+
+
+def with_conversation(context: GenerationContext, memory: Optional[ConversationMemory]) -> GenerationContext:
+    """Attach the connection's rolling summary and recent turns to a chat prompt."""
+    conversation = memory.render() if memory is not None else ""
+    if not conversation:
+        return context
+    return dataclasses.replace(context, conversation=conversation)
+
+
+def remember_turn(memory: Optional[ConversationMemory], question: str, answer: str):
+    # Both sides are recorded together once the reply is complete, so concurrent
+    # requests never interleave a question with another request's answer
+    if memory is not None:
+        memory.add("user", question)
+        memory.add("assistant", answer)
+
+
+async def handle_chat_message(data: dict, user_id: Optional[str] = None,
+                              user_context: Optional[UserLLMContext] = None,
+                              memory: Optional[ConversationMemory] = None) -> cht:
     chat_msg = cht(
         role=data.get("role", "user"),
         content=data.get("content", ""),
@@ -139,8 +151,11 @@ async def handle_chat_message(data: dict, user_id: Optional[str] = None) -> cht:
     )
 
     # Get appropriate LLM service (user-specific or default)
-    service = await get_user_llm_service(user_id)
-    ai_response = await service.generate_response(chat_msg.content, getattr(chat_msg, "tone", ""), user_id=user_id)
+    service, context = await get_user_llm_service(user_id, user_context)
+    context = with_conversation(context, memory)
+    async with llm_scheduler.slot(service.api_key, user_id, service.key_count):
+        ai_response = await service.generate_response(chat_msg.content, getattr(chat_msg, "tone", ""), context=context)
+    remember_turn(memory, chat_msg.content, ai_response)
     response = cht(
         role="assistant",
         content=ai_response,
@@ -149,17 +164,50 @@ async def handle_chat_message(data: dict, user_id: Optional[str] = None) -> cht:
     return response
 
 
-async def handle_email_request(data: dict, user_id: Optional[str] = None) -> dict:
-    email_req = em(
+async def stream_chat_message(data: dict, request_id: str, user_id: Optional[str] = None,
+                              user_context: Optional[UserLLMContext] = None,
+                              memory: Optional[ConversationMemory] = None) -> AsyncGenerator[dict, None]:
+    """Stream a chat reply as start, delta and end frames correlated by request_id."""
+    chat_msg = cht(
         role=data.get("role", "user"),
-        receiverEmail=data.get("receiverEmail", ""),
-        prompt=data.get("prompt", ""),
-        tone=data.get("tone", "")
+        content=data.get("content", ""),
+        tone=data.get("tone", ""),
+        timestamp=data.get("timestamp") or int(time.time())
     )
 
-    # Get appropriate LLM service (user-specific or default)
-    service = await get_user_llm_service(user_id)
-    
+    service, context = await get_user_llm_service(user_id, user_context)
+    context = with_conversation(context, memory)
+
+    ticket = llm_scheduler.enqueue(service.api_key, user_id, service.key_count)
+    try:
+        async for frame in queued_frames(ticket, request_id):
+            yield frame
+
+        yield {"type": "stream_start", "request_id": request_id, "mode": "chat", "timestamp": int(time.time())}
+
+        ai_response = ""
+        chunks = service.chat_with_gemini(chat_msg.content, getattr(chat_msg, "tone", ""), context=context)
+        async for chunk in stream_pacer.pace(chunks):
+            ai_response += chunk
+            yield {"type": "stream_delta", "request_id": request_id, "delta": chunk}
+    finally:
+        ticket.release()
+
+    remember_turn(memory, chat_msg.content, ai_response)
+    yield {
+        "type": "stream_end",
+        "request_id": request_id,
+        "role": "assistant",
+        "content": ai_response,
+        "timestamp": int(time.time())
+    }
+
+
+async def get_email_llm_service(email_req: em, user_id: Optional[str] = None,
+                                user_context: Optional[UserLLMContext] = None) -> Tuple[LLMService, GenerationContext]:
+    """Get the LLM service and context for an email request, failing if no model is available."""
+    service, context = await get_user_llm_service(user_id, user_context)
+
     # Check if service is available before generating
     if not service.is_available():
         # Log error for unavailable service
@@ -176,7 +224,351 @@ async def handle_email_request(data: dict, user_id: Optional[str] = None) -> dic
                 }
             )
         raise Exception("AI service unavailable. Please configure GOOGLE_API_KEY.")
-    
-    email_content = await service.generate_email(email_req.prompt, email_req.tone, email_req.receiverEmail, user_id=user_id)
 
-    return email_content
\ No newline at end of file
+    return service, context
+
+
+async def with_style_examples(context: GenerationContext, email_req: em,
+                              user_id: Optional[str] = None) -> GenerationContext:
+    """Attach the user's sent emails most similar to this request when AI learning is on."""
+    if not (context.ai_learning and user_id and settings.style_examples_k > 0):
+        return context
+
+    try:
+        examples = await style_index_service.top_k(
+            user_id, email_req.prompt, email_req.receiverEmail, k=settings.style_examples_k,
+            profile_version=context.style_profile_version
+        )
+    except Exception as e:
+        print(f"Error retrieving style examples: {e}")
+        # Continue with the profile alone if retrieval fails
+        return context
+
+    return dataclasses.replace(context, style_examples=examples)
+
+
+def email_cache_key(email_req: em, context: GenerationContext) -> str:
+    """Cache key covering everything that shapes the generated email."""
+    return email_response_cache.make_key(
+        email_req.prompt,
+        email_req.tone or context.default_tone,
+        email_req.receiverEmail,
+        context.language,
+        context.style_profile_version if context.ai_learning else 0
+    )
+
+
+def cached_email_content(cached: dict, email_req: em) -> dict:
+    """Return a cache hit addressed to the recipient exactly as this request spelled it."""
+    return {
+        **cached,
+        "email": {**cached["email"], "to": email_req.receiverEmail},
+        "cached": True,
+        "served_by": "cache"
+    }
+
+
+class EmailFlight:
+    """One in-flight email generation shared by identical concurrent requests.
+
+    Frames are recorded as they are produced so a request that joins late
+    replays everything sent so far and then follows the live stream. When
+    every subscriber has gone (cancelled or disconnected) the generation is
+    cancelled too.
+    """
+
+    def __init__(self, frames: AsyncGenerator[dict, None]):
+        self.frames: List[dict] = []
+        self.done = False
+        self.abandoned = False
+        self.subscribers = 0
+        self.error: Optional[Exception] = None
+        self.updated = asyncio.Event()
+        self.task = asyncio.create_task(self.run(frames))
+
+    async def run(self, frames: AsyncGenerator[dict, None]):
+        try:
+            async for frame in frames:
+                self.frames.append(frame)
+                self.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.notify()
+
+    def notify(self):
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def subscribe(self, request_id: str, recipient: str) -> AsyncGenerator[dict, None]:
+        """Yield the flight's frames addressed to this subscriber's request id.
+
+        Requests share a flight whatever the casing of the recipient, so the
+        final ``email`` frame is addressed to ``recipient`` as this subscriber
+        spelled it.
+        """
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                while index < len(self.frames):
+                    frame = {**self.frames[index], "request_id": request_id}
+                    if frame["type"] == "email":
+                        frame["email"] = {**frame["email"], "to": recipient}
+                    yield frame
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await self.updated.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self.abandoned = True
+                self.task.cancel()
+
+
+# In-flight email generations keyed by (user_id, cache key)
+email_flights: Dict[Tuple[str, str], EmailFlight] = {}
+
+
+def email_parser_frames(events: List[Tuple[str, str]]) -> List[dict]:
+    """Turn parser events into an early ``email_subject`` frame and body deltas."""
+    return [
+        {"type": "email_subject", "subject": text} if kind == "subject" else {"type": "stream_delta", "delta": text}
+        for kind, text in events
+    ]
+
+
+async def generate_email_frames(service: LLMService, context: GenerationContext, email_req: em,
+                                user_id: Optional[str], cache_key: Optional[str]) -> AsyncGenerator[dict, None]:
+    """Generate one email as stream frames and cache the parsed result (unless ``cache_key`` is None)."""
+    context = await with_style_examples(context, email_req, user_id)
+
+    ticket = llm_scheduler.enqueue(service.api_key, user_id, service.key_count)
+    try:
+        async for frame in queued_frames(ticket, ""):
+            yield frame
+
+        yield {"type": "stream_start", "mode": "email", "timestamp": int(time.time())}
+
+        # The system pool hands out its least busy healthy key for this generation
+        with service.lease() as member:
+            served_by = member.key_label
+            parser = EmailStreamParser()
+            chunks = member.chat_with_gemini(
+                email_req.prompt, email_req.tone, is_email=True, recipient=email_req.receiverEmail, context=context
+            )
+            async for chunk in stream_pacer.pace(chunks):
+                for frame in email_parser_frames(parser.feed(chunk)):
+                    yield frame
+    finally:
+        ticket.release()
+
+    for frame in email_parser_frames(parser.close()):
+        yield frame
+    yield {"type": "stream_end", "timestamp": int(time.time())}
+
+    email_content = parser.result(email_req.receiverEmail)
+    if cache_key is not None:
+        email_response_cache.put(user_id, cache_key, email_content)
+    yield {"type": "email", **email_content, "served_by": served_by}
+
+
+def join_email_flight(service: LLMService, context: GenerationContext, email_req: em,
+                      user_id: Optional[str], cache_key: str, regenerate: bool = False) -> EmailFlight:
+    """Attach to an identical generation already running for this user, or start one.
+
+    A regenerate request always gets a fresh generation of its own, which is
+    not shared with later identical requests.
+    """
+    if regenerate:
+        return EmailFlight(generate_email_frames(service, context, email_req, user_id, cache_key))
+
+    flight_key = (user_id or "", cache_key)
+    flight = email_flights.get(flight_key)
+    if flight is None or flight.abandoned:
+        flight = EmailFlight(generate_email_frames(service, context, email_req, user_id, cache_key))
+        email_flights[flight_key] = flight
+        flight.task.add_done_callback(lambda _: release_email_flight(flight_key, flight))
+    return flight
+
+
+def release_email_flight(flight_key: Tuple[str, str], flight: EmailFlight):
+    if email_flights.get(flight_key) is flight:
+        del email_flights[flight_key]
+
+
+def candidate_count(data: dict) -> int:
+    """Number of alternative drafts requested, capped by EMAIL_MAX_CANDIDATES."""
+    try:
+        requested = int(data.get("candidates") or 1)
+    except (TypeError, ValueError):
+        requested = 1
+    return max(1, min(requested, settings.email_max_candidates))
+
+
+async def email_candidate_frames(service: LLMService, context: GenerationContext, email_req: em,
+                                 user_id: Optional[str], count: int) -> AsyncGenerator[dict, None]:
+    """Generate ``count`` drafts side by side, interleaving their frames.
+
+    Every frame carries its ``candidate`` index. Each draft is a separate
+    scheduled generation, so the scheduler's per-key limits still apply. A
+    draft that fails sends a ``stream_error`` for its index and the rest go on.
+    """
+    frames: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int):
+        try:
+            async for frame in generate_email_frames(service, context, email_req, user_id, None):
+                frames.put_nowait({**frame, "candidate": index})
+        except Exception as e:
+            print(f"Error generating email candidate {index}: {e}")
+            frames.put_nowait({
+                "type": "stream_error",
+                "candidate": index,
+                "role": "assistant",
+                "content": "This draft could not be generated.",
+                "timestamp": int(time.time())
+            })
+        finally:
+            frames.put_nowait(None)
+
+    tasks = [asyncio.create_task(run(index)) for index in range(count)]
+    try:
+        running = count
+        while running:
+            frame = await frames.get()
+            if frame is None:
+                running -= 1
+                continue
+            yield frame
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def record_regenerations(user_id: Optional[str], email_id: Optional[str], count: int) -> Optional[int]:
+    """Count the drafts against a saved email's regeneration counter; returns the new count."""
+    if not (user_id and email_id):
+        return None
+
+    try:
+        async with await db_manager.get_session() as db:
+            email = await email_service.update_email(
+                db, user_id, email_id, increment_regeneration=True, regenerations=count
+            )
+        return email.regeneration_count if email else None
+    except Exception as e:
+        print(f"Error recording regenerations: {e}")
+        return None
+
+
+async def stream_email_candidates(service: LLMService, context: GenerationContext, email_req: em,
+                                  user_id: Optional[str], count: int,
+                                  email_id: Optional[str] = None) -> AsyncGenerator[dict, None]:
+    """Stream alternative drafts, then an ``email_candidates`` frame listing the ones that succeeded.
+
+    Candidates bypass the response cache and single-flight sharing, since
+    every draft is meant to differ.
+    """
+    emails: List[dict] = []
+    async for frame in email_candidate_frames(service, context, email_req, user_id, count):
+        if frame["type"] == "email":
+            emails.append(frame)
+        yield frame
+
+    if not emails:
+        raise Exception("No email candidate could be generated.")
+
+    emails.sort(key=lambda frame: frame["candidate"])
+    regeneration_count = await record_regenerations(user_id, email_id, len(emails))
+    yield {
+        "type": "email_candidates",
+        "email": emails[0]["email"],
+        "candidates": [{"candidate": frame["candidate"], **frame["email"]} for frame in emails],
+        "regeneration_count": regeneration_count,
+        "success": True
+    }
+
+
+def email_request(data: dict) -> em:
+    return em(
+        role=data.get("role", "user"),
+        receiverEmail=data.get("receiverEmail", ""),
+        prompt=data.get("prompt", ""),
+        tone=data.get("tone", "")
+    )
+
+
+async def handle_email_request(data: dict, user_id: Optional[str] = None,
+                               user_context: Optional[UserLLMContext] = None) -> dict:
+    email_req = email_request(data)
+
+    # Get appropriate LLM service (user-specific or default)
+    service, context = await get_email_llm_service(email_req, user_id, user_context)
+
+    count = candidate_count(data)
+    if count > 1:
+        email_content = {}
+        served_by = None
+        async for frame in stream_email_candidates(service, context, email_req, user_id, count, data.get("email_id")):
+            if frame["type"] == "email" and served_by is None:
+                served_by = frame.get("served_by")
+            elif frame["type"] == "email_candidates":
+                email_content = {k: v for k, v in frame.items() if k != "type"}
+        return {**email_content, "served_by": served_by}
+
+    cache_key = email_cache_key(email_req, context)
+    cached = None if data.get("regenerate") else email_response_cache.get(user_id, cache_key)
+    if cached:
+        return cached_email_content(cached, email_req)
+
+    # Identical concurrent requests share one generation
+    email_content = {}
+    async for frame in join_email_flight(
+        service, context, email_req, user_id, cache_key, regenerate=bool(data.get("regenerate"))
+    ).subscribe("", email_req.receiverEmail):
+        if frame["type"] == "email":
+            email_content = {k: v for k, v in frame.items() if k not in ("type", "request_id")}
+    return email_content
+
+
+async def stream_email_request(data: dict, request_id: str, user_id: Optional[str] = None,
+                               user_context: Optional[UserLLMContext] = None) -> AsyncGenerator[dict, None]:
+    """Stream a generated email as start, subject, body delta and end frames, then the parsed email.
+
+    With ``candidates`` above one, the alternative drafts stream side by side instead.
+    """
+    email_req = email_request(data)
+
+    service, context = await get_email_llm_service(email_req, user_id, user_context)
+
+    count = candidate_count(data)
+    if count > 1:
+        async for frame in stream_email_candidates(service, context, email_req, user_id, count, data.get("email_id")):
+            yield {**frame, "request_id": request_id}
+        return
+
+    cache_key = email_cache_key(email_req, context)
+    cached = None if data.get("regenerate") else email_response_cache.get(user_id, cache_key)
+    if cached:
+        # Replay the cached email as its subject and a single body delta
+        email_content = cached_email_content(cached, email_req)
+        email = email_content["email"]
+        yield {"type": "stream_start", "request_id": request_id, "mode": "email", "cached": True,
+               "timestamp": int(time.time())}
+        yield {"type": "email_subject", "request_id": request_id, "subject": email["subject"]}
+        yield {"type": "stream_delta", "request_id": request_id, "delta": email["body"]}
+        yield {"type": "stream_end", "request_id": request_id, "timestamp": int(time.time())}
+        yield {"type": "email", "request_id": request_id, **email_content}
+        return
+
+    # Identical concurrent requests share one generation
+    async for frame in join_email_flight(
+        service, context, email_req, user_id, cache_key, regenerate=bool(data.get("regenerate"))
+    ).subscribe(request_id, email_req.receiverEmail):
+        yield frame
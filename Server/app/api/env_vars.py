@@ -12,6 +12,8 @@ from app.models.schemas import (
 )
 from app.services.env_vars_service import env_vars_service
 from app.services.user_activity_service import user_activity_service
+from app.services.llm_client_cache import llm_client_cache
+from app.services.user_context_service import user_context_service
 from app.core.security import get_current_user_from_token
 from app.core.database import DatabaseManager
 from typing import Dict, Any
@@ -141,6 +143,11 @@ async def create_or_update_variable(
                 variable_changed = True
         
         var = await env_vars_service.create_or_update_variable(db, current_user["id"], var_data)
+
+        # Cached LLM clients were built with the previous key
+        if var.key == "GOOGLE_API_KEY":
+            llm_client_cache.invalidate_user(current_user["id"])
+            user_context_service.invalidate(current_user["id"])
         
         # Log activity
         if is_new or variable_changed:
@@ -201,6 +208,11 @@ async def update_variable(
         # Update using create_or_update (which handles updates)
         var_create = EnvironmentVariableCreate(key=key, value=var_data.value)
         var = await env_vars_service.create_or_update_variable(db, current_user["id"], var_create)
+
+        # Cached LLM clients were built with the previous key
+        if var.key == "GOOGLE_API_KEY":
+            llm_client_cache.invalidate_user(current_user["id"])
+            user_context_service.invalidate(current_user["id"])
         
         return {
             "success": True,
@@ -8,6 +8,11 @@ class Settings(BaseSettings):
 
     # API Keys
     google_api_key: Optional[str] = os.getenv("GOOGLE_API_KEY")
+    # Extra comma-separated system keys; fallback traffic is balanced across all of them
+    google_api_keys: str = os.getenv("GOOGLE_API_KEYS", "")
+    # A system key answering 429 sits out this long, doubling on repeats up to the max
+    system_key_cooldown_seconds: float = float(os.getenv("SYSTEM_KEY_COOLDOWN_SECONDS", "30"))
+    system_key_max_cooldown_seconds: float = float(os.getenv("SYSTEM_KEY_MAX_COOLDOWN_SECONDS", "600"))
     # murf_api_key: Optional[str] = os.getenv("MURF_API_KEY")
     # murf_api_url: Optional[str] = os.getenv("MURF_API_URL")
     # assemblyai_api_key: Optional[str] = os.getenv("ASSEMBLYAI_API_KEY")
@@ -48,6 +53,78 @@ class Settings(BaseSettings):
     # max_prompt_length: int = 10000
     max_response_tokens: int = 3000
 
+    # Per-user LLM client cache
+    llm_client_cache_size: int = int(os.getenv("LLM_CLIENT_CACHE_SIZE", "256"))
+    llm_client_cache_ttl_seconds: int = int(os.getenv("LLM_CLIENT_CACHE_TTL_SECONDS", "1800"))
+
+    # LLM admission scheduler: concurrency caps and per-key rate limit (0 RPM disables it)
+    llm_max_concurrent: int = int(os.getenv("LLM_MAX_CONCURRENT", "32"))
+    llm_max_concurrent_per_key: int = int(os.getenv("LLM_MAX_CONCURRENT_PER_KEY", "4"))
+    llm_key_requests_per_minute: float = float(os.getenv("LLM_KEY_REQUESTS_PER_MINUTE", "60"))
+    llm_key_burst: int = int(os.getenv("LLM_KEY_BURST", "10"))
+
+    # Maximum number of per-key Gemini transports kept open
+    gemini_client_pool_size: int = int(os.getenv("GEMINI_CLIENT_POOL_SIZE", "256"))
+
+    # LLM backend: "gemini", or "stub" for offline load tests (canned text, no network)
+    llm_provider: str = os.getenv("LLM_PROVIDER", "gemini").strip().lower()
+    llm_stub_text: str = os.getenv(
+        "LLM_STUB_TEXT",
+        "This is a canned reply from the stub LLM provider, streamed at a fixed rate for load testing."
+    ).replace("\\n", "\n")
+    llm_stub_email_text: str = os.getenv(
+        "LLM_STUB_EMAIL_TEXT",
+        "Subject: Stub email\n\nHello,\n\nThis is a canned email from the stub LLM provider, "
+        "streamed at a fixed rate for load testing.\n\nBest regards,\nHarshit Sharma"
+    ).replace("\\n", "\n")
+    llm_stub_tokens_per_second: float = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", "50"))
+    llm_stub_first_token_latency_ms: int = int(os.getenv("LLM_STUB_FIRST_TOKEN_LATENCY_MS", "300"))
+
+    # Static prompt prefixes precompiled per (mode, language, tone)
+    prompt_template_cache_size: int = int(os.getenv("PROMPT_TEMPLATE_CACHE_SIZE", "256"))
+
+    # API key validation cache (keys are probed when saved, not per message)
+    api_key_valid_ttl_seconds: int = int(os.getenv("API_KEY_VALID_TTL_SECONDS", "86400"))
+    api_key_invalid_ttl_seconds: int = int(os.getenv("API_KEY_INVALID_TTL_SECONDS", "300"))
+
+    # How long a WebSocket connection reuses its loaded preferences and API key
+    ws_user_context_ttl_seconds: int = int(os.getenv("WS_USER_CONTEXT_TTL_SECONDS", "60"))
+    # Requests one WebSocket connection may run at once, and may have running or waiting
+    ws_max_inflight_per_connection: int = int(os.getenv("WS_MAX_INFLIGHT_PER_CONNECTION", "4"))
+    ws_max_pending_per_connection: int = int(os.getenv("WS_MAX_PENDING_PER_CONNECTION", "16"))
+    # Open WebSocket caps per worker and per user, heartbeat period and idle eviction
+    ws_max_connections: int = int(os.getenv("WS_MAX_CONNECTIONS", "1000"))
+    ws_max_connections_per_user: int = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "5"))
+    ws_heartbeat_interval_seconds: float = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "25"))
+    ws_idle_timeout_seconds: float = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "900"))
+    # Outbound frames buffered per connection, and how long a full buffer is tolerated
+    ws_send_queue_max_frames: int = int(os.getenv("WS_SEND_QUEUE_MAX_FRAMES", "256"))
+    ws_send_stall_timeout_seconds: float = float(os.getenv("WS_SEND_STALL_TIMEOUT_SECONDS", "10"))
+
+    # Writing-style examples retrieved per email when AI learning is on
+    style_examples_k: int = int(os.getenv("STYLE_EXAMPLES_K", "2"))
+    style_index_max_entries: int = int(os.getenv("STYLE_INDEX_MAX_ENTRIES", "200"))
+
+    # Exact-match cache of generated emails (skipped when a request sets "regenerate")
+    email_cache_enabled: bool = os.getenv("EMAIL_CACHE_ENABLED", "true").lower() == "true"
+    email_cache_size: int = int(os.getenv("EMAIL_CACHE_SIZE", "1024"))
+    email_cache_ttl_seconds: int = int(os.getenv("EMAIL_CACHE_TTL_SECONDS", "600"))
+
+    # Conversational memory for WebSocket chat, in approximate tokens (0 window disables it)
+    chat_memory_window_tokens: int = int(os.getenv("CHAT_MEMORY_WINDOW_TOKENS", "1500"))
+    chat_memory_summary_tokens: int = int(os.getenv("CHAT_MEMORY_SUMMARY_TOKENS", "300"))
+    # Saved chat messages used to seed a new connection's memory
+    chat_memory_seed_messages: int = int(os.getenv("CHAT_MEMORY_SEED_MESSAGES", "20"))
+
+    # Upper bound on alternative drafts generated in parallel for one email request
+    email_max_candidates: int = int(os.getenv("EMAIL_MAX_CANDIDATES", "4"))
+
+    # Streaming Settings
+    # Deltas are merged for up to this many milliseconds (0 sends every chunk as-is)
+    stream_coalesce_window_ms: int = int(os.getenv("STREAM_COALESCE_WINDOW_MS", "40"))
+    # A merged delta is flushed early once this many characters are pending
+    stream_coalesce_max_chars: int = int(os.getenv("STREAM_COALESCE_MAX_CHARS", "256"))
+
     # Authentication Settings
     secret_key: str = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
     algorithm: str = os.getenv("ALGORITHM", "HS256")
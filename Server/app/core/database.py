@@ -97,6 +97,17 @@ class EmailMessageModel(Base):
     timestamp = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class UserStyleProfileModel(Base):
+    __tablename__ = "user_style_profiles"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, unique=True, nullable=False, index=True)
+    profile = Column(JSON, nullable=False)  # Aggregated writing-style statistics
+    sample_count = Column(Integer, default=0)  # Number of sent emails folded in
+    version = Column(Integer, default=0)  # Bumped on every update
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 class DatabaseManager:
     def __init__(self):
         self.engine = None
@@ -0,0 +1,72 @@
+from typing import Optional
+from google.api_core import exceptions as google_exceptions
+from app.core.config import settings
+from app.services.ttl_cache import TTLCache, hash_api_key
+
+
+class ApiKeyValidator:
+    """Cache of Gemini API key validity with separate positive and negative TTLs.
+
+    Keys are probed once when saved, and marked invalid again whenever a real
+    generation fails with an auth error, so chat requests never need a live
+    probe of their own.
+    """
+
+    def __init__(self, valid_ttl_seconds: int = 86400, invalid_ttl_seconds: int = 300, max_size: int = 4096):
+        self.valid_ttl_seconds = valid_ttl_seconds
+        self.invalid_ttl_seconds = invalid_ttl_seconds
+        self._results: "TTLCache[str, bool]" = TTLCache(max_size, valid_ttl_seconds)
+
+    def _store(self, api_key: str, is_valid: bool):
+        ttl = self.valid_ttl_seconds if is_valid else self.invalid_ttl_seconds
+        self._results.put(hash_api_key(api_key), is_valid, ttl)
+
+    def get_status(self, api_key: str) -> Optional[bool]:
+        """Return the cached validity of a key, or None when unknown or expired."""
+        return self._results.get(hash_api_key(api_key))
+
+    def mark_valid(self, api_key: str):
+        self._store(api_key, True)
+
+    def mark_invalid(self, api_key: str):
+        self._store(api_key, False)
+
+    @staticmethod
+    def is_auth_error(error: Exception) -> bool:
+        """Whether a Gemini error means the API key itself was rejected."""
+        if isinstance(error, (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied)):
+            return True
+        if isinstance(error, google_exceptions.InvalidArgument):
+            message = str(error)
+            return "API key" in message or "API_KEY_INVALID" in message
+        return False
+
+    async def validate(self, api_key: str) -> bool:
+        """Probe Gemini once with a minimal request and cache the outcome."""
+        from app.services.llm_providers import GeminiProvider
+
+        provider = GeminiProvider(api_key)
+        if not provider.is_available():
+            self.mark_invalid(api_key)
+            return False
+
+        try:
+            await provider.probe()
+        except Exception as e:
+            if not self.is_auth_error(e):
+                # Quota or network trouble says nothing about the key; leave it unknown
+                print(f"API key validation inconclusive: {e}")
+                return True
+            print(f"API key validation failed: {e}")
+            self.mark_invalid(api_key)
+            return False
+
+        self.mark_valid(api_key)
+        return True
+
+
+# Global validator instance
+api_key_validator = ApiKeyValidator(
+    valid_ttl_seconds=settings.api_key_valid_ttl_seconds,
+    invalid_ttl_seconds=settings.api_key_invalid_ttl_seconds
+)
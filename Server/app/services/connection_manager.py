@@ -0,0 +1,97 @@
+import asyncio
+import time
+from typing import Any, Dict, Set
+from app.core.config import settings
+
+
+class ConnectionManager:
+    """Registry of the WebSocket connections open on this worker.
+
+    Enforces the per-worker and per-user connection caps, and runs one monitor
+    task per connection that sends heartbeats (to clients that asked for them)
+    and evicts sockets that stop answering or sit idle with no work in flight.
+    """
+
+    def __init__(self, max_connections: int = 1000, max_per_user: int = 5,
+                 heartbeat_interval: float = 25, idle_timeout: float = 900):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._connections: Dict[str, Any] = {}  # session_id -> WebSocketHandler
+        self._users: Dict[str, Set[str]] = {}  # user_id -> session_ids
+        self.evicted = 0
+
+    def has_capacity(self) -> bool:
+        return len(self._connections) < self.max_connections
+
+    def register(self, handler: Any):
+        self._connections[handler.session_id] = handler
+
+    def bind_user(self, handler: Any) -> bool:
+        """Count the connection against its user, unless the user is already at the cap."""
+        sessions = self._users.setdefault(handler.user_id, set())
+        if handler.session_id not in sessions and len(sessions) >= self.max_per_user:
+            if not sessions:
+                del self._users[handler.user_id]
+            return False
+        sessions.add(handler.session_id)
+        return True
+
+    def unregister(self, handler: Any):
+        self._connections.pop(handler.session_id, None)
+        sessions = self._users.get(handler.user_id)
+        if sessions is not None:
+            sessions.discard(handler.session_id)
+            if not sessions:
+                del self._users[handler.user_id]
+
+    async def monitor(self, handler: Any):
+        """Heartbeat and idle checks for one connection; returns once it is evicted."""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            silent_for = time.monotonic() - handler.last_seen
+
+            if handler.heartbeat and silent_for > self.heartbeat_interval * 2:
+                # Two pings went unanswered: the peer is gone
+                await self.evict(handler, "heartbeat timeout")
+                return
+            if not handler.tasks and silent_for > self.idle_timeout:
+                await self.evict(handler, "idle timeout")
+                return
+
+            if handler.heartbeat:
+                try:
+                    await handler.send({"type": "ping", "timestamp": int(time.time())})
+                except Exception:
+                    await self.evict(handler, "heartbeat send failed")
+                    return
+
+    async def evict(self, handler: Any, reason: str):
+        print(f"Closing WebSocket {handler.session_id}: {reason}")
+        self.evicted += 1
+        handler.close_code = 4408
+        await handler.cancel_all()
+        await handler.disconnect()
+
+    def stats(self) -> dict:
+        handlers = list(self._connections.values())
+        return {
+            "connections": len(handlers),
+            "authenticated": sum(1 for handler in handlers if handler.user_id),
+            "users": len(self._users),
+            "inflight_requests": sum(len(handler.tasks) for handler in handlers),
+            "queued_frames": sum(len(handler.outbox) for handler in handlers),
+            "evicted": self.evicted,
+            "max_connections": self.max_connections,
+            "max_per_user": self.max_per_user
+        }
+
+
+# Global connection registry for this worker
+connection_manager = ConnectionManager(
+    max_connections=settings.ws_max_connections,
+    max_per_user=settings.ws_max_connections_per_user,
+    heartbeat_interval=settings.ws_heartbeat_interval_seconds,
+    idle_timeout=settings.ws_idle_timeout_seconds
+)
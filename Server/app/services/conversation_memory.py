@@ -0,0 +1,132 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional
+from app.core.config import settings
+from app.core.database import db_manager
+from app.services.chat_service import chat_service
+
+SUMMARY_LINE_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) used for budgeting."""
+    return max(1, len(text) // 4)
+
+
+@dataclass
+class Turn:
+    role: str  # 'user' or 'assistant'
+    content: str
+    tokens: int
+
+
+class ConversationMemory:
+    """Recent chat turns of one connection, kept within a token budget.
+
+    New turns are appended to a window; once it exceeds ``window_tokens`` the
+    oldest turns are folded into a rolling summary, one short line per turn,
+    and the summary itself drops its oldest lines past ``summary_tokens``. The
+    rendered block therefore never grows past the two budgets combined.
+    """
+
+    def __init__(self, window_tokens: int = 1500, summary_tokens: int = 300):
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.turns: Deque[Turn] = deque()
+        self.summary: Deque[str] = deque()
+        self._window_used = 0
+        self._summary_used = 0
+
+    def add(self, role: str, content: str):
+        content = content.strip()
+        if not content:
+            return
+
+        max_chars = self.window_tokens * 4
+        if len(content) > max_chars:
+            content = content[:max_chars] + "…"
+
+        turn = Turn(role, content, estimate_tokens(content))
+        self.turns.append(turn)
+        self._window_used += turn.tokens
+
+        while self._window_used > self.window_tokens and len(self.turns) > 1:
+            self._fold(self.turns.popleft())
+
+    def discard_trailing_user_turn(self, content: str):
+        """Drop the newest turn if it is this user message, so it is not repeated in the prompt."""
+        if self.turns and self.turns[-1].role == "user" and self.turns[-1].content == content.strip():
+            self._window_used -= self.turns.pop().tokens
+
+    def _fold(self, turn: Turn):
+        """Move a turn out of the window into the summary as a single line."""
+        self._window_used -= turn.tokens
+
+        text = " ".join(turn.content.split())
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "…"
+        line = f"- {turn.role.capitalize()}: {text}"
+        self.summary.append(line)
+        self._summary_used += estimate_tokens(line)
+
+        while self._summary_used > self.summary_tokens and self.summary:
+            self._summary_used -= estimate_tokens(self.summary.popleft())
+
+    def render(self) -> str:
+        """Prompt block with the summary and recent turns; empty when there is no history."""
+        if not self.turns and not self.summary:
+            return ""
+
+        block = "Conversation so far:\n"
+        if self.summary:
+            block += "Summary of earlier turns:\n" + "\n".join(self.summary) + "\n"
+        if self.turns:
+            block += "Recent turns:\n"
+            block += "\n".join(f"{turn.role.capitalize()}: {turn.content}" for turn in self.turns) + "\n"
+        return block
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+
+class ConversationMemoryService:
+    """Creates per-connection memories seeded from the user's saved chat history."""
+
+    def __init__(self, window_tokens: int = 1500, summary_tokens: int = 300, seed_messages: int = 20):
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.seed_messages = seed_messages
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_tokens > 0
+
+    async def load(self, user_id: str) -> Optional[ConversationMemory]:
+        """Return a memory holding the latest saved text turns, or None when memory is disabled."""
+        if not self.enabled:
+            return None
+
+        memory = ConversationMemory(self.window_tokens, self.summary_tokens)
+        if self.seed_messages <= 0:
+            return memory
+
+        try:
+            async with await db_manager.get_session() as db:
+                messages = await chat_service.get_user_messages(db, user_id, limit=self.seed_messages)
+        except Exception as e:
+            print(f"Error loading chat history for conversation memory: {e}")
+            # Start from an empty window rather than failing the chat
+            return memory
+
+        for message in messages:
+            if message.message_type == "text" and message.sender in ("user", "assistant"):
+                memory.add(message.sender, message.content)
+        return memory
+
+
+# Global memory service instance
+conversation_memory_service = ConversationMemoryService(
+    window_tokens=settings.chat_memory_window_tokens,
+    summary_tokens=settings.chat_memory_summary_tokens,
+    seed_messages=settings.chat_memory_seed_messages
+)
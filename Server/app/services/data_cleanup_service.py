@@ -4,6 +4,7 @@ from app.core.database import db_manager, UserModel
 from app.services.email_service import email_service
 from app.services.chat_service import chat_service
 from app.services.user_activity_service import user_activity_service
+from app.services.style_index_service import style_index_service
 import asyncio
 import logging
 
@@ -67,6 +68,10 @@ class DataCleanupService:
                         
                         await session.commit()
                         
+                        if emails_deleted > 0:
+                            # Rebuilt from the remaining sent emails on next use
+                            style_index_service.drop_user(user_id)
+                        
                         if emails_deleted > 0 or messages_deleted > 0 or activities_deleted > 0:
                             logger.info(
                                 f"Cleaned up data for user {user_id}: "
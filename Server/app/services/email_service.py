@@ -1,6 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, func, or_
 from app.core.database import EmailMessageModel
+from app.services.style_profile_service import style_profile_service
+from app.services.style_index_service import style_index_service
+from app.services.user_context_service import user_context_service
 from datetime import datetime
 from typing import List, Optional
 
@@ -33,7 +36,25 @@ class EmailService:
         db.add(new_email)
         await db.commit()
         await db.refresh(new_email)
+
+        if status == "sent":
+            await self._record_sent_style(db, user_id, new_email)
         return new_email
+
+    async def _record_sent_style(self, db: AsyncSession, user_id: str, email: EmailMessageModel):
+        """Fold a newly sent email into the user's writing-style profile and example index."""
+        profile_version = None
+        try:
+            profile = await style_profile_service.record_sent_email(db, user_id, email.subject, email.body)
+            profile_version = profile.version
+            user_context_service.invalidate(user_id)
+        except Exception as e:
+            # The profile is best-effort; never fail the email update over it
+            print(f"Failed to update style profile: {e}")
+            await db.rollback()
+        # Passing the new profile version keeps the index current instead of forcing a rebuild
+        style_index_service.add_email(user_id, email.email_id, email.to_email, email.subject, email.body,
+                                      profile_version)
     
     async def get_user_emails(
         self,
@@ -90,13 +111,16 @@ class EmailService:
         subject: Optional[str] = None,
         to_email: Optional[str] = None,
         increment_regeneration: bool = False,
-        increment_version: bool = False
+        increment_version: bool = False,
+        regenerations: int = 1
     ) -> Optional[EmailMessageModel]:
-        """Update an email"""
+        """Update an email (``regenerations`` is how many drafts one regeneration produced)"""
         email = await self.get_email_by_id(db, user_id, email_id)
         if not email:
             return None
         
+        newly_sent = status == "sent" and email.status != "sent"
+        
         if status is not None:
             email.status = status
             if status == "sent":
@@ -112,13 +136,16 @@ class EmailService:
             email.to_email = to_email
         
         if increment_regeneration:
-            email.regeneration_count += 1
+            email.regeneration_count += regenerations
         
         if increment_version:
             email.version += 1
         
         await db.commit()
         await db.refresh(email)
+
+        if newly_sent:
+            await self._record_sent_style(db, user_id, email)
         return email
     
     async def get_email_count(
@@ -198,5 +225,6 @@ class EmailService:
         )
         await db.execute(query)
         await db.commit()
+        style_index_service.drop_user(user_id)
 
 email_service = EmailService()
\ No newline at end of file
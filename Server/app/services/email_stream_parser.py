@@ -0,0 +1,119 @@
+from typing import List, Optional, Tuple
+
+DEFAULT_SUBJECT = "AI Generated Email"
+
+
+class EmailStreamParser:
+    """Split a generated email into subject and body while it streams in.
+
+    Text is held back only until the subject is known: either a ``Subject:``
+    line turns up among the first few lines, or the first line is taken as
+    the subject when it looks like one (short, no trailing period, not a
+    greeting). After that every chunk becomes a body delta straight away.
+    Leading and trailing whitespace of the body is dropped, so the joined
+    deltas equal the final parsed body.
+    """
+
+    def __init__(self, max_head_lines: int = 3, max_head_chars: int = 400):
+        self.max_head_lines = max_head_lines
+        self.max_head_chars = max_head_chars
+        self.subject: Optional[str] = None
+        self._head = ""
+        self._body_parts: List[str] = []
+        self._body_started = False
+        self._trailing = ""
+
+    @property
+    def body(self) -> str:
+        return "".join(self._body_parts)
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Consume a chunk; return ("subject", text) and ("body", delta) events."""
+        if self.subject is not None:
+            return self._body_delta(chunk)
+
+        self._head += chunk
+        rest = self._decide_subject(final=False)
+        if rest is None:
+            return []
+        return [("subject", self.subject)] + self._body_delta(rest)
+
+    def close(self) -> List[Tuple[str, str]]:
+        """Finish the stream, deciding the subject if it is still open."""
+        if self.subject is not None:
+            return []
+        rest = self._decide_subject(final=True)
+        return [("subject", self.subject)] + self._body_delta(rest)
+
+    def result(self, recipient: str) -> dict:
+        return {
+            "email": {
+                "subject": self.subject or DEFAULT_SUBJECT,
+                "to": recipient,
+                "body": self.body
+            },
+            "success": True
+        }
+
+    def _decide_subject(self, final: bool) -> Optional[str]:
+        """Set the subject once it can be known and return the text that follows it.
+
+        Only the first ``max_head_lines`` non-empty lines starting within the
+        first ``max_head_chars`` characters can hold the ``Subject:`` line, so
+        the result is the same however the text was split into chunks.
+        """
+        text = self._head.lstrip()
+        lines = text.split("\n")
+        offset = 0
+        seen = 0
+        for i, line in enumerate(lines):
+            partial = not final and i == len(lines) - 1
+            stripped = line.strip().lower()
+            if partial and ("subject:".startswith(stripped) or stripped.startswith("subject:")):
+                # This may be (or is) the subject line; wait for the rest of it
+                return None
+            if not partial and stripped.startswith("subject:"):
+                self.subject = line.split(":", 1)[1].strip()
+                return "\n".join(lines[i + 1:])
+
+            if stripped:
+                seen += 1
+            offset += len(line) + 1
+            if (seen >= self.max_head_lines and not partial) or offset >= self.max_head_chars:
+                break
+        else:
+            if not final:
+                return None
+
+        # No Subject: line; fall back to treating a title-like first line as the subject
+        first_line, _, rest = text.partition("\n")
+        first_line = first_line.strip()
+        if (
+            (final or "\n" in text)
+            and first_line
+            and len(first_line) < 100
+            and not first_line.endswith('.')
+            and not first_line.startswith('Dear')
+            and not first_line.startswith('Hello')
+        ):
+            self.subject = first_line
+            return rest
+
+        self.subject = DEFAULT_SUBJECT
+        return text
+
+    def _body_delta(self, chunk: str) -> List[Tuple[str, str]]:
+        if not self._body_started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return []
+            self._body_started = True
+
+        # Hold back trailing whitespace until more text shows it is not the end
+        text = self._trailing + chunk
+        delta = text.rstrip()
+        self._trailing = text[len(delta):]
+        if not delta:
+            return []
+        self._body_parts.append(delta)
+        return [("body", delta)]
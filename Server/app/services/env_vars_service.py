@@ -9,6 +9,7 @@ import os
 from app.core.database import UserEnvironmentVariablesModel
 from app.core.config import settings
 from app.models.schemas import EnvironmentVariableCreate, EnvironmentVariableUpdate
+from app.services.api_key_validator import api_key_validator
 
 
 class EnvVarsService:
@@ -49,6 +50,11 @@ class EnvVarsService:
         existing = await self.get_variable_by_key(db, user_id, var_data.key)
         
         encrypted_value = self._encrypt_value(var_data.value)
+
+        # Validate the Gemini key once here so chat requests can trust the cached result;
+        # other providers never use it, so saving it must not call Google
+        if var_data.key == "GOOGLE_API_KEY" and var_data.value.strip() and settings.llm_provider == "gemini":
+            await api_key_validator.validate(var_data.value)
         
         if existing:
             # Update existing variable
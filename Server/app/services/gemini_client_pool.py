@@ -0,0 +1,39 @@
+from collections import OrderedDict
+import google.ai.generativelanguage as glm
+from app.core.config import settings
+from app.services.ttl_cache import hash_api_key
+
+
+class GeminiClientPool:
+    """One async Gemini transport per API key.
+
+    ``genai.configure`` swaps a process-global client, so concurrent requests
+    made with different user keys would race on it. Instead every key owns its
+    own ``GenerativeServiceAsyncClient``; models using the same key share it
+    and reuse its connection. Clients are created lazily on the running event
+    loop. Once the pool is full the least recently used one is only dropped,
+    not closed: a stream may still be reading from it, and its channel is
+    closed when the last reference goes away.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._clients: "OrderedDict[str, glm.GenerativeServiceAsyncClient]" = OrderedDict()
+
+    def get_async_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        fingerprint = hash_api_key(api_key)
+        client = self._clients.get(fingerprint)
+        if client is None:
+            client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+            self._clients[fingerprint] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(fingerprint)
+        return client
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+# Global pool instance
+gemini_client_pool = GeminiClientPool(max_size=settings.gemini_client_pool_size)
@@ -0,0 +1,49 @@
+from typing import Optional, Tuple
+from app.core.config import settings
+from app.services.llm_service import LLMService
+from app.services.ttl_cache import TTLCache, hash_api_key
+
+
+class LLMClientCache:
+    """Bounded LRU + TTL cache of configured per-user LLMService instances.
+
+    Entries are keyed by user id plus a hash of the decrypted API key, so a
+    changed key never reuses a client built for the old one.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_seconds: int = 1800):
+        self._entries: "TTLCache[Tuple[str, str], LLMService]" = TTLCache(max_size, ttl_seconds)
+
+    def get(self, user_id: str, api_key: str) -> Optional[LLMService]:
+        """Return a cached service for this user and key, if still fresh."""
+        return self._entries.get((user_id, hash_api_key(api_key)))
+
+    def put(self, user_id: str, api_key: str, service: LLMService):
+        """Store a service, evicting the least recently used entries over capacity."""
+        self._entries.put((user_id, hash_api_key(api_key)), service)
+
+    def get_or_create(self, user_id: str, api_key: str) -> LLMService:
+        """Return the cached service for this user and key, building it on a miss."""
+        service = self.get(user_id, api_key)
+        if service is None:
+            service = LLMService(api_key=api_key)
+            if service.is_available():
+                self.put(user_id, api_key, service)
+        return service
+
+    def invalidate_user(self, user_id: str):
+        """Drop every cached service for a user (e.g. after their API key changes)."""
+        self._entries.discard_where(lambda cache_key: cache_key[0] == user_id)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Global cache instance
+llm_client_cache = LLMClientCache(
+    max_size=settings.llm_client_cache_size,
+    ttl_seconds=settings.llm_client_cache_ttl_seconds
+)
@@ -0,0 +1,138 @@
+import asyncio
+import re
+from abc import ABC, abstractmethod
+import google.ai.generativelanguage as glm
+from typing import AsyncGenerator, Optional
+from app.core.config import settings
+from app.services.gemini_client_pool import gemini_client_pool
+from app.services.prompt_templates import PromptTemplate
+
+TOKEN_PATTERN = re.compile(r"\s*\S+\s*")
+
+
+class LLMProvider(ABC):
+    """A text generation backend behind LLMService.
+
+    Prompt building, scheduling and key handling stay in the service; a
+    provider only turns a prompt template plus the per-request text into a
+    stream of text chunks.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def is_available(self) -> bool:
+        ...
+
+    @abstractmethod
+    def stream(self, template: PromptTemplate, request_text: str,
+               max_tokens: int) -> AsyncGenerator[str, None]:
+        """Yield the generated text chunk by chunk (implemented as an async generator)."""
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through the per-key async client from gemini_client_pool."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str], model_name: str = "gemini-2.5-flash"):
+        self.api_key = api_key
+        self.model_name = model_name
+
+    def is_available(self) -> bool:
+        return bool(self.api_key)
+
+    def get_client(self) -> glm.GenerativeServiceAsyncClient:
+        """Return this key's async client.
+
+        The client is looked up on every call, which keeps busy keys at the
+        fresh end of the pool's LRU and picks up a new client if the old one
+        was evicted in the meantime. The key is never set via genai.configure.
+        """
+        return gemini_client_pool.get_async_client(self.api_key)
+
+    def build_request(self, prompt: str, max_tokens: int, temperature: float = 0.7,
+                      top_p: float = 0.9) -> glm.GenerateContentRequest:
+        return glm.GenerateContentRequest(
+            model=f"models/{self.model_name}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=glm.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+                top_p=top_p
+            )
+        )
+
+    @staticmethod
+    def response_text(response: glm.GenerateContentResponse) -> str:
+        """Text of the first candidate; raises when the prompt itself was blocked."""
+        if response.prompt_feedback.block_reason:
+            raise ValueError(f"Prompt blocked: {response.prompt_feedback.block_reason.name}")
+        if not response.candidates:
+            return ""
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+    async def probe(self):
+        """Send a one-token request, raising whatever error Gemini returns for this key."""
+        await self.get_client().generate_content(self.build_request("test", max_tokens=1))
+
+    async def stream(self, template: PromptTemplate, request_text: str,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        # Use the async transport so a slow generation never blocks the event loop
+        response = await self.get_client().stream_generate_content(
+            self.build_request(template.render(request_text), max_tokens)
+        )
+
+        async for chunk in response:
+            text = self.response_text(chunk)
+            if text:
+                yield text
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline backend for load tests and benchmarks.
+
+    Streams canned text word by word after ``first_token_latency_ms``, at
+    ``tokens_per_second`` (0 streams as fast as possible). It needs no API key
+    and makes no network calls, so measurements show only server overhead.
+    """
+
+    name = "stub"
+
+    def __init__(self, chat_text: str, email_text: str, tokens_per_second: float = 50,
+                 first_token_latency_ms: int = 300):
+        self.chat_text = chat_text
+        self.email_text = email_text
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency_ms = first_token_latency_ms
+
+    def is_available(self) -> bool:
+        return True
+
+    async def stream(self, template: PromptTemplate, request_text: str,
+                     max_tokens: int) -> AsyncGenerator[str, None]:
+        text = self.email_text if template.mode == "email" else self.chat_text
+        tokens = TOKEN_PATTERN.findall(text)[:max_tokens]
+
+        loop = asyncio.get_running_loop()
+        started_at = loop.time() + self.first_token_latency_ms / 1000
+        for i, token in enumerate(tokens):
+            # Pace against a fixed schedule so sleep overshoot does not accumulate
+            delay = started_at - loop.time()
+            if self.tokens_per_second > 0:
+                delay += i / self.tokens_per_second
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield token
+
+
+def create_provider(api_key: Optional[str]) -> LLMProvider:
+    """Build the provider selected by LLM_PROVIDER for one API key."""
+    if settings.llm_provider == "stub":
+        return StubProvider(
+            chat_text=settings.llm_stub_text,
+            email_text=settings.llm_stub_email_text,
+            tokens_per_second=settings.llm_stub_tokens_per_second,
+            first_token_latency_ms=settings.llm_stub_first_token_latency_ms
+        )
+    return GeminiProvider(api_key)
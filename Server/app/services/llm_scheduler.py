@@ -0,0 +1,227 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Deque, Dict, Optional, Tuple
+from app.core.config import settings
+from app.services.ttl_cache import hash_api_key
+
+
+class TokenBucket:
+    """Requests-per-minute limiter that allows short bursts up to ``capacity``."""
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        # ``now`` may predate a bucket created after the caller read the clock
+        if now <= self.updated_at:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until the next token is available."""
+        if self.rate <= 0:
+            return 0.0
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class Ticket:
+    """A single request's place in the scheduler queue."""
+
+    def __init__(self, scheduler: "LLMScheduler", key: str, user: str, key_count: int = 1):
+        self.scheduler = scheduler
+        self.key = key
+        self.key_count = key_count
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+        self.released = False
+
+    def waited_ms(self) -> int:
+        return int((time.monotonic() - self.enqueued_at) * 1000)
+
+    async def wait(self) -> AsyncGenerator[Tuple[int, int], None]:
+        """Yield (queue position, waited ms) whenever the position changes, until admitted.
+
+        Yields nothing when a slot is free straight away.
+        """
+        last_position = None
+        while not self.admitted.done():
+            position = self.scheduler.position(self)
+            if position != last_position:
+                last_position = position
+                yield position, self.waited_ms()
+
+            self.changed.clear()
+            changed = asyncio.ensure_future(self.changed.wait())
+            try:
+                await asyncio.wait({self.admitted, changed}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                changed.cancel()
+
+    def release(self):
+        """Give the slot back (or leave the queue if never admitted)."""
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self)
+
+
+class LLMScheduler:
+    """Admission control in front of LLM generation.
+
+    A request is admitted only while both the global and its API key's
+    concurrency caps have room and the key's token bucket has a token.
+    Waiting requests are queued per user and admitted round-robin across
+    users, so one busy user cannot starve everyone sharing the system key.
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_concurrent_per_key: int = 4,
+                 requests_per_minute: float = 60, burst: int = 10):
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_per_key = max_concurrent_per_key
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self._active = 0
+        self._active_per_key: Dict[str, int] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._retry_handle: Optional[asyncio.TimerHandle] = None
+
+    def _bucket(self, key: str, key_count: int = 1) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.requests_per_minute * key_count, self.burst * key_count)
+        return bucket
+
+    def enqueue(self, api_key: Optional[str], user_id: Optional[str], key_count: int = 1) -> Ticket:
+        """Queue a request for a slot on this key; admission is immediate when possible.
+
+        ``key_count`` scales the per-key limits for a service backed by a pool of keys.
+        """
+        ticket = Ticket(self, hash_api_key(api_key or ""), user_id or "", key_count)
+        self._queues.setdefault(ticket.user, deque()).append(ticket)
+        self._dispatch()
+        return ticket
+
+    @asynccontextmanager
+    async def slot(self, api_key: Optional[str], user_id: Optional[str], key_count: int = 1):
+        """Hold a generation slot for the duration of the block."""
+        ticket = self.enqueue(api_key, user_id, key_count)
+        try:
+            async for _ in ticket.wait():
+                pass
+            yield ticket
+        finally:
+            ticket.release()
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position under round-robin order, ignoring per-key limits."""
+        queue = self._queues.get(ticket.user)
+        if not queue or ticket not in queue:
+            return 0
+        index = queue.index(ticket)
+        position = 1
+        ahead = True
+        for user, other in self._queues.items():
+            if user == ticket.user:
+                ahead = False
+                continue
+            position += min(len(other), index + 1 if ahead else index)
+        return position + index
+
+    def release(self, ticket: Ticket):
+        if ticket.admitted.done() and not ticket.admitted.cancelled():
+            self._active -= 1
+            self._active_per_key[ticket.key] -= 1
+            if not self._active_per_key[ticket.key]:
+                del self._active_per_key[ticket.key]
+                if self._bucket(ticket.key).is_full(time.monotonic()):
+                    del self._buckets[ticket.key]
+        else:
+            queue = self._queues.get(ticket.user)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.user]
+            if not ticket.admitted.done():
+                ticket.admitted.cancel()
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        retry_in = None
+
+        while self._active < self.max_concurrent and self._queues:
+            admitted = None
+            for user, queue in self._queues.items():
+                ticket = queue[0]
+                if self._active_per_key.get(ticket.key, 0) >= self.max_concurrent_per_key * ticket.key_count:
+                    continue
+                bucket = self._bucket(ticket.key, ticket.key_count)
+                if not bucket.try_take(now):
+                    wait = bucket.wait_time(now)
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                    continue
+                admitted = ticket
+                break
+
+            if admitted is None:
+                break
+
+            queue = self._queues[admitted.user]
+            queue.popleft()
+            if queue:
+                # Round-robin: this user goes to the back of the line
+                self._queues.move_to_end(admitted.user)
+            else:
+                del self._queues[admitted.user]
+            self._active += 1
+            self._active_per_key[admitted.key] = self._active_per_key.get(admitted.key, 0) + 1
+            admitted.admitted.set_result(True)
+
+        if retry_in is not None and self._retry_handle is None:
+            self._retry_handle = asyncio.get_running_loop().call_later(retry_in, self._retry)
+
+        for queue in self._queues.values():
+            for ticket in queue:
+                ticket.changed.set()
+
+    def _retry(self):
+        self._retry_handle = None
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "queued_users": len(self._queues)
+        }
+
+
+# Global scheduler instance
+llm_scheduler = LLMScheduler(
+    max_concurrent=settings.llm_max_concurrent,
+    max_concurrent_per_key=settings.llm_max_concurrent_per_key,
+    requests_per_minute=settings.llm_key_requests_per_minute,
+    burst=settings.llm_key_burst
+)
@@ -1,225 +1,222 @@
-import asyncio
-import google.generativeai as genai
-from typing import AsyncGenerator, Optional
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from google.api_core import exceptions as google_exceptions
+from typing import AsyncGenerator, Iterator, List, Optional, Tuple
 from app.core.config import settings
+from app.services.api_key_validator import api_key_validator
+from app.services.email_stream_parser import EmailStreamParser
+from app.services.llm_providers import create_provider
+from app.services.prompt_templates import prompt_templates
+
+@dataclass(frozen=True)
+class GenerationContext:
+    """Immutable per-request user preferences, style profile, examples and chat history.
+
+    Passed through chat_with_gemini instead of being stored on the service, so
+    one shared LLMService can serve any number of concurrent users.
+    """
+    language: str = "English"
+    default_tone: str = "Professional"
+    ai_learning: bool = False
+    style_profile: str = ""  # Rendered profile learned from the user's sent emails
+    style_profile_version: int = 0
+    style_examples: Tuple[Tuple[str, str], ...] = ()  # (subject, body) of the most relevant sent emails
+    conversation: str = ""  # Rendered summary and recent turns of the chat so far
+
+
+DEFAULT_CONTEXT = GenerationContext()
 
-PERSONA = {
-    "name": "MailAgent",
-    "role": "AI Email and Chat Assistant",
-    "your_info": (
-        "You are MailAgent, an intelligent AI assistant developed by Harshit Sharma. "
-        "Your purpose is to help users with their communication needs - from casual conversations "
-        "to crafting professional emails. You excel at understanding context and adapting to different "
-        "communication styles and tones."
-    ),
-    "chat_instructions": (
-        "You are a helpful and conversational AI assistant. "
-        "Provide clear, accurate, and concise responses. "
-        "Be friendly yet professional. "
-        "When users ask about sending emails, politely inform them: "
-        "'To send an email, please use the /email command with the recipient's address.' "
-        "Focus on being helpful and informative without being overly verbose."
-    ),
-    "email_instructions": (
-        "Generate professional, well-structured emails based on the user's brief message. "
-        "Your email should have:\n"
-        "1. A clear and relevant subject line\n"
-        "2. Appropriate greeting based on context\n"
-        "3. Well-organized body with proper paragraphs\n"
-        "4. Professional closing\n"
-        "5. Signature as 'Harshit Sharma'\n\n"
-        "Adapt the formality and tone based on the specified tone preference. "
-        "Make the email feel natural and human-written, not robotic."
-    ),
-}
 
 class LLMService:
-    def __init__(self, api_key: Optional[str] = None):
-        self.model = None
-        self.api_key = api_key or settings.google_api_key
-        self.user_preferences = None  # Store user preferences
+    key_count = 1  # Number of API keys behind this service, for scheduler capacity
 
-        try:
-            if self.api_key:
-                genai.configure(api_key=self.api_key)
-                self.model = genai.GenerativeModel("gemini-2.5-flash")
-                self.max_tokens = settings.max_response_tokens
-        except Exception as e:
-            print(f"Error initializing model: {e}")
+    def __init__(self, api_key: Optional[str] = None, key_label: str = "user"):
+        self.api_key = api_key or settings.google_api_key
+        self.key_label = key_label  # Safe name for logs; never the key itself
+        self.max_tokens = settings.max_response_tokens
+        self.provider = create_provider(self.api_key)
 
     def is_available(self) -> bool:
-        return self.model is not None
-    
-    def set_user_preferences(self, language: str = "English", default_tone: str = "Professional", 
-                           ai_learning: bool = False):
-        """Set user preferences for personalized responses."""
-        self.user_preferences = {
-            "language": language,
-            "default_tone": default_tone,
-            "ai_learning": ai_learning
-        }
-    
+        return self.provider.is_available()
+
+    @contextmanager
+    def lease(self) -> Iterator["LLMService"]:
+        """Yield the service that should run one generation (pools pick a member key)."""
+        yield self
+
     def reconfigure(self, api_key: str):
         """Reconfigure the LLM service with a new API key."""
-        try:
-            self.api_key = api_key
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel("gemini-2.5-flash")
-            self.max_tokens = settings.max_response_tokens
-            return True
-        except Exception as e:
-            print(f"Error reconfiguring model: {e}")
-            return False
+        self.api_key = api_key
+        self.provider = create_provider(api_key)
+        return self.provider.is_available()
 
-    async def chat_with_gemini(self, message: str, tone: str = "", is_email: bool = False, recipient: str = "", user_id: str = None) -> AsyncGenerator[str, None]:
+    async def chat_with_gemini(self, message: str, tone: str = "", is_email: bool = False, recipient: str = "",
+                               context: GenerationContext = DEFAULT_CONTEXT) -> AsyncGenerator[str, None]:
         if not self.is_available():
             yield "I'm sorry, but the AI service is currently unavailable. Please try again later."
             return
         
-        # Use user preferences if available
-        user_language = self.user_preferences.get("language", "English") if self.user_preferences else "English"
-        default_tone = self.user_preferences.get("default_tone", "Professional") if self.user_preferences else "Professional"
-        ai_learning_enabled = self.user_preferences.get("ai_learning", False) if self.user_preferences else False
-        
         # Use provided tone or fall back to user's default tone
-        effective_tone = tone if tone else default_tone
-        
-        # Language instruction
-        language_instruction = ""
-        if user_language and user_language != "English":
-            language_instruction = f" Respond in {user_language} language."
- 
+        effective_tone = tone if tone else context.default_tone
+
+        # The static persona, rules and tone guidance come precompiled; only the request part is built here
+        template = prompt_templates.get("email" if is_email else "chat", context.language, effective_tone)
+
         if is_email:
-            # Fetch user's past emails for pattern learning if enabled
+            # Precomputed writing-style profile and relevant past emails, when enabled
             email_examples = ""
-            if ai_learning_enabled and user_id:
-                try:
-                    from app.core.database import db_manager
-                    from app.services.email_service import email_service
-                    
-                    async with db_manager.session_factory() as db:
-                        past_emails = await email_service.get_user_emails(
-                            db, user_id, status="sent", limit=3
-                        )
-                    
-                    if past_emails:
-                        examples_list = []
-                        for i, email in enumerate(past_emails, 1):
-                            examples_list.append(
-                                f"Example {i}:\n"
-                                f"Subject: {email.subject}\n"
-                                f"{email.body[:500]}..." if len(email.body) > 500 else f"{email.body}"
-                            )
-                        
-                        email_examples = (
-                            f"\n\n📧 USER'S PREVIOUS EMAIL WRITING STYLE:\n"
-                            f"{'=' * 60}\n"
-                            f"{'\n\n'.join(examples_list)}\n"
-                            f"{'=' * 60}\n\n"
-                            f"IMPORTANT: Analyze the above examples and mimic the user's:\n"
-                            f"- Writing style and vocabulary\n"
-                            f"- Sentence structure and paragraph organization\n"
-                            f"- Level of formality and tone\n"
-                            f"- Common phrases and expressions\n"
-                            f"- Greeting and closing patterns\n\n"
-                        )
-                except Exception as e:
-                    print(f"Error fetching email patterns: {e}")
-                    # Continue without examples if fetch fails
-            
-            # Improved email generation prompt
-            system_prompt = (
-                f"You are {PERSONA['name']}, {PERSONA['your_info']}\n\n"
-                f"{PERSONA['email_instructions']}"
+            if context.ai_learning and (context.style_profile or context.style_examples):
+                email_examples = "\n\n📧 USER'S EMAIL WRITING STYLE (learned from their sent emails):\n"
+                if context.style_profile:
+                    email_examples += f"{context.style_profile}\n"
+                for i, (subject, body) in enumerate(context.style_examples, 1):
+                    excerpt = body[:300] + "..." if len(body) > 300 else body
+                    email_examples += f"\nExample {i}:\nSubject: {subject}\n{excerpt}\n"
+                email_examples += (
+                    f"\nIMPORTANT: Mimic this style - greeting and closing patterns, length, "
+                    f"sentence structure and level of formality.\n\n"
+                )
+
+            request_text = (
                 f"{email_examples}"
                 f"\nContext:\n"
                 f"- Recipient: {recipient}\n"
-                f"- User's request: {message}\n"
-                f"- Required tone: {effective_tone}\n\n"
-                f"IMPORTANT FORMAT REQUIREMENTS:\n"
-                f"1. Start with 'Subject: [your subject]'\n"
-                f"2. Leave one blank line after subject\n"
-                f"3. Begin with appropriate greeting (Dear/Hello/Hi based on tone)\n"
-                f"4. Write clear, natural email body\n"
-                f"5. End with professional closing\n"
-                f"6. Sign as 'Harshit Sharma'\n\n"
-                f"Tone guidance:\n"
-                f"- Professional: Formal, respectful, business-appropriate\n"
-                f"- Friendly: Warm, personable, yet professional\n"
-                f"- Casual: Relaxed, conversational, informal\n"
-                f"- Formal: Very structured, official, ceremonious\n"
-                f"- Confident: Assertive, clear, authoritative\n\n"
+                f"- User's request: {message}\n\n"
                 f"Generate a complete, natural-sounding email now:"
             )
         else:
-            # Improved chat prompt
-            system_prompt = (
-                f"You are {PERSONA['name']}, {PERSONA['your_info']}\n\n"
-                f"{PERSONA['chat_instructions']}\n\n"
-                f"User's question: {message}\n"
-            )
-            
-            if effective_tone and effective_tone != "Professional":
-                system_prompt += f"\nTone: Keep your response {effective_tone.lower()}.\n"
-            
-            system_prompt += language_instruction
-
-        response = self.model.generate_content(
-                system_prompt,
-                stream=True,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=self.max_tokens,
-                    top_p=0.9
-                )
-            )
-        
-        accumulated_response = ""
-        for chunk in response:
-            if chunk.text:
-                accumulated_response += chunk.text
-                yield chunk.text
-                await asyncio.sleep(0.05)
+            conversation = f"\n{context.conversation}" if context.conversation else ""
+            request_text = f"{conversation}\nUser's question: {message}\n"
 
+        try:
+            async for chunk in self.provider.stream(template, request_text, self.max_tokens):
+                yield chunk
+        except Exception as e:
+            # A rejected key is remembered so the next request falls back without probing
+            if api_key_validator.is_auth_error(e):
+                api_key_validator.mark_invalid(self.api_key)
+            raise
 
-    async def generate_response(self, message: str, tone: str = "", user_id: str = None) -> str:
+    async def generate_response(self, message: str, tone: str = "", context: GenerationContext = DEFAULT_CONTEXT) -> str:
         accumulated_response = ""
-        async for chunk in self.chat_with_gemini(message, tone, user_id=user_id):
+        async for chunk in self.chat_with_gemini(message, tone, context=context):
             accumulated_response += chunk
 
         return accumulated_response
 
-    async def generate_email(self, prompt: str, tone: str, recipient: str, user_id: str = None) -> dict:
+    async def generate_email(self, prompt: str, tone: str, recipient: str, context: GenerationContext = DEFAULT_CONTEXT) -> dict:
         if not self.is_available():
             return {"error": "I'm sorry, but the AI service is currently unavailable. Please try again later."}
 
-        accumulated_response = ""
-        async for chunk in self.chat_with_gemini(prompt, tone, is_email=True, recipient=recipient, user_id=user_id):
-            accumulated_response += chunk
-        email_text = accumulated_response.strip()
-        subject = "AI Generated Email"
-        body = email_text
-
-        lines = email_text.split("\n")
-        for i, line in enumerate(lines):
-            if line.strip().lower().startswith("subject:"):
-                subject = line.split(":", 1)[1].strip()
-                body = '\n'.join(lines[i+1:]).strip()
-                break
-
-        if subject == "AI Generated Email" and lines:
-            first_line = lines[0].strip()
-            if len(first_line) < 100 and not first_line.endswith('.') and not first_line.startswith('Dear') and not first_line.startswith('Hello'):
-                subject = first_line
-                body = '\n'.join(lines[1:]).strip()
-
-        return {
-            "email": {
-                "subject": subject,
-                "to": recipient,
-                "body": body
-            },
-            "success": True
-        }
-
-llm_service = LLMService()
\ No newline at end of file
+        parser = EmailStreamParser()
+        async for chunk in self.chat_with_gemini(prompt, tone, is_email=True, recipient=recipient, context=context):
+            parser.feed(chunk)
+        parser.close()
+        return parser.result(recipient)
+
+    def parse_email(self, email_text: str, recipient: str) -> dict:
+        """Split a generated email into subject and body."""
+        parser = EmailStreamParser()
+        parser.feed(email_text)
+        parser.close()
+        return parser.result(recipient)
+
+class SystemKeyPool(LLMService):
+    """System fallback service spreading requests over several API keys.
+
+    Each generation goes to the healthy key with the fewest outstanding
+    requests. A key that answers 429 (or rejects auth) is cooled down, with the
+    cooldown doubling on consecutive failures, and skipped until it expires.
+    """
+
+    def __init__(self, api_keys: List[str], cooldown_seconds: float = 30, max_cooldown_seconds: float = 600):
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.key_label = "system"
+        self.max_tokens = settings.max_response_tokens
+        self.set_keys(api_keys)
+
+    def set_keys(self, api_keys: List[str]):
+        """Replace the pool's keys, resetting load and health tracking."""
+        if not api_keys and settings.llm_provider == "stub":
+            # The stub needs no credentials, so an offline server still gets one member
+            api_keys = [""]
+        self.members = [
+            LLMService(api_key, key_label=f"system-{i}") for i, api_key in enumerate(api_keys, 1)
+        ]
+        self.outstanding = {member.key_label: 0 for member in self.members}
+        self.cooldown_until = {member.key_label: 0.0 for member in self.members}
+        self.strikes = {member.key_label: 0 for member in self.members}
+        self.last_used = {member.key_label: 0.0 for member in self.members}
+
+        self.api_key = api_keys[0] if api_keys else None
+        self.key_count = max(1, len(self.members))
+
+    def is_available(self) -> bool:
+        return any(member.is_available() for member in self.members)
+
+    def select(self) -> LLMService:
+        """Pick the healthy key with the fewest outstanding requests."""
+        candidates = [member for member in self.members if member.is_available()]
+        now = time.monotonic()
+        healthy = [member for member in candidates if self.cooldown_until[member.key_label] <= now]
+        if healthy:
+            return min(healthy, key=lambda m: (self.outstanding[m.key_label], self.last_used[m.key_label]))
+        # Every key is cooling down: use the one that recovers first
+        return min(candidates, key=lambda m: self.cooldown_until[m.key_label])
+
+    @staticmethod
+    def is_rate_limit_error(error: Exception) -> bool:
+        return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests))
+
+    def cool_down(self, member: LLMService):
+        label = member.key_label
+        self.strikes[label] += 1
+        cooldown = min(self.cooldown_seconds * 2 ** (self.strikes[label] - 1), self.max_cooldown_seconds)
+        self.cooldown_until[label] = time.monotonic() + cooldown
+        print(f"System API key {label} cooling down for {cooldown:.0f}s")
+
+    @contextmanager
+    def lease(self) -> Iterator[LLMService]:
+        member = self.select()
+        label = member.key_label
+        self.outstanding[label] += 1
+        self.last_used[label] = time.monotonic()
+        try:
+            yield member
+        except Exception as e:
+            if self.is_rate_limit_error(e) or api_key_validator.is_auth_error(e):
+                self.cool_down(member)
+            raise
+        else:
+            self.strikes[label] = 0
+        finally:
+            self.outstanding[label] -= 1
+
+    async def chat_with_gemini(self, message: str, tone: str = "", is_email: bool = False, recipient: str = "",
+                               context: GenerationContext = DEFAULT_CONTEXT) -> AsyncGenerator[str, None]:
+        if not self.is_available():
+            yield "I'm sorry, but the AI service is currently unavailable. Please try again later."
+            return
+
+        with self.lease() as member:
+            async for chunk in member.chat_with_gemini(message, tone, is_email, recipient, context=context):
+                yield chunk
+
+    def reconfigure(self, api_key: str):
+        self.set_keys([api_key])
+        return self.is_available()
+
+
+def system_api_keys() -> List[str]:
+    """GOOGLE_API_KEY followed by any extra GOOGLE_API_KEYS, without duplicates."""
+    keys = [settings.google_api_key or ""] + settings.google_api_keys.split(",")
+    return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
+
+llm_service = SystemKeyPool(
+    system_api_keys(),
+    cooldown_seconds=settings.system_key_cooldown_seconds,
+    max_cooldown_seconds=settings.system_key_max_cooldown_seconds
+)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional
+
+
+class SlowConsumerError(Exception):
+    """The client stopped reading and its send queue stayed full."""
+
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by a single writer task.
+
+    Producers never write to the socket themselves, so a slow reader cannot
+    stall generation. While frames are backed up, a ``stream_delta`` is merged
+    into the latest queued delta of the same request (and candidate draft),
+    and pings are dropped.
+    Any other frame waits for room below ``max_frames``; if none frees up
+    within ``stall_timeout`` seconds the queue gives up on the client.
+    """
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], max_frames: int = 256,
+                 stall_timeout: float = 10.0):
+        self._send = send
+        self.max_frames = max_frames
+        self.stall_timeout = stall_timeout
+        self._frames: Deque[dict] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._sending = False
+        self.closed = False
+        self.saturated = False
+        self.coalesced = 0
+        self.dropped = 0
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def _merge(self, frame: dict) -> bool:
+        """Fold a delta into the newest queued frame of its stream, if that is a delta.
+
+        A stream is a request, or one candidate draft within a request.
+        """
+        request_id = frame.get("request_id")
+        candidate = frame.get("candidate")
+        for queued in reversed(self._frames):
+            if queued.get("request_id") != request_id:
+                continue
+            if queued.get("type") != "stream_delta" or queued.get("candidate") != candidate:
+                return False
+            queued["delta"] += frame["delta"]
+            self.coalesced += 1
+            return True
+        return False
+
+    async def put(self, frame: dict):
+        if self.closed:
+            raise SlowConsumerError("Connection is closed")
+
+        if self._frames:
+            frame_type = frame.get("type")
+            if frame_type == "stream_delta" and self._merge(frame):
+                return
+            if frame_type == "ping":
+                self.dropped += 1
+                return
+
+        while len(self._frames) >= self.max_frames:
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.stall_timeout)
+            except asyncio.TimeoutError:
+                self.closed = self.saturated = True
+                raise SlowConsumerError(f"Send queue stayed full for {self.stall_timeout}s")
+            if self.closed:
+                raise SlowConsumerError("Connection is closed")
+
+        # Copy so a later merge never mutates a frame the producer still holds
+        self._frames.append(dict(frame))
+        self._ready.set()
+
+    async def _run(self):
+        try:
+            while True:
+                while not self._frames:
+                    self._ready.clear()
+                    await self._ready.wait()
+                frame = self._frames.popleft()
+                self._space.set()
+                self._sending = True
+                await self._send(frame)
+                self._sending = False
+        finally:
+            # Wake any producer waiting for room so it sees the queue is gone
+            self.closed = True
+            self._space.set()
+
+    async def close(self, flush_timeout: float = 0):
+        """Stop the writer, first giving queued frames up to ``flush_timeout`` seconds to go out."""
+        if self._writer is None:
+            return
+        if flush_timeout > 0 and not self._writer.done():
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + flush_timeout
+            while (self._frames or self._sending) and not self._writer.done() and loop.time() < deadline:
+                await asyncio.sleep(0.01)
+        self.closed = True
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+from app.core.config import settings
+
+PERSONA = {
+    "name": "MailAgent",
+    "role": "AI Email and Chat Assistant",
+    "your_info": (
+        "You are MailAgent, an intelligent AI assistant developed by Harshit Sharma. "
+        "Your purpose is to help users with their communication needs - from casual conversations "
+        "to crafting professional emails. You excel at understanding context and adapting to different "
+        "communication styles and tones."
+    ),
+    "chat_instructions": (
+        "You are a helpful and conversational AI assistant. "
+        "Provide clear, accurate, and concise responses. "
+        "Be friendly yet professional. "
+        "When users ask about sending emails, politely inform them: "
+        "'To send an email, please use the /email command with the recipient's address.' "
+        "Focus on being helpful and informative without being overly verbose."
+    ),
+    "email_instructions": (
+        "Generate professional, well-structured emails based on the user's brief message. "
+        "Your email should have:\n"
+        "1. A clear and relevant subject line\n"
+        "2. Appropriate greeting based on context\n"
+        "3. Well-organized body with proper paragraphs\n"
+        "4. Professional closing\n"
+        "5. Signature as 'Harshit Sharma'\n\n"
+        "Adapt the formality and tone based on the specified tone preference. "
+        "Make the email feel natural and human-written, not robotic."
+    ),
+}
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """The static part of a prompt for one (mode, language, tone) variant.
+
+    ``prefix`` holds the persona, instructions and tone guidance, which are the
+    same for every request of this variant; only the per-request text follows it.
+    """
+    mode: str
+    language: str
+    tone: str
+    prefix: str
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.mode, self.language, self.tone
+
+    def render(self, request_text: str) -> str:
+        return self.prefix + request_text
+
+
+class PromptTemplateRegistry:
+    """Precompiled prompt prefixes, built once per variant and kept in an LRU."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._templates: "OrderedDict[Tuple[str, str, str], PromptTemplate]" = OrderedDict()
+
+    def get(self, mode: str, language: str, tone: str) -> PromptTemplate:
+        if mode == "email":
+            # Email prompts carry no language instruction, so one template serves every language
+            language = ""
+        key = (mode, language or "", tone or "")
+
+        template = self._templates.get(key)
+        if template is None:
+            prefix = self._email_prefix(key[2]) if mode == "email" else self._chat_prefix(key[1], key[2])
+            template = self._templates[key] = PromptTemplate(*key, prefix=prefix)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        self._templates.move_to_end(key)
+        return template
+
+    def _email_prefix(self, tone: str) -> str:
+        return (
+            f"You are {PERSONA['name']}, {PERSONA['your_info']}\n\n"
+            f"{PERSONA['email_instructions']}\n\n"
+            f"IMPORTANT FORMAT REQUIREMENTS:\n"
+            f"1. Start with 'Subject: [your subject]'\n"
+            f"2. Leave one blank line after subject\n"
+            f"3. Begin with appropriate greeting (Dear/Hello/Hi based on tone)\n"
+            f"4. Write clear, natural email body\n"
+            f"5. End with professional closing\n"
+            f"6. Sign as 'Harshit Sharma'\n\n"
+            f"Tone guidance:\n"
+            f"- Professional: Formal, respectful, business-appropriate\n"
+            f"- Friendly: Warm, personable, yet professional\n"
+            f"- Casual: Relaxed, conversational, informal\n"
+            f"- Formal: Very structured, official, ceremonious\n"
+            f"- Confident: Assertive, clear, authoritative\n\n"
+            f"Required tone: {tone}\n"
+        )
+
+    def _chat_prefix(self, language: str, tone: str) -> str:
+        prefix = (
+            f"You are {PERSONA['name']}, {PERSONA['your_info']}\n\n"
+            f"{PERSONA['chat_instructions']}\n\n"
+        )
+        if tone and tone != "Professional":
+            prefix += f"Tone: Keep your response {tone.lower()}.\n"
+        if language and language != "English":
+            prefix += f"Respond in {language} language.\n"
+        return prefix
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+# Global registry instance
+prompt_templates = PromptTemplateRegistry(max_size=settings.prompt_template_cache_size)
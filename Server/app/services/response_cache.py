@@ -0,0 +1,52 @@
+import hashlib
+from typing import Optional, Tuple, Dict, Any
+from app.core.config import settings
+from app.services.ttl_cache import TTLCache
+
+
+class EmailResponseCache:
+    """Exact-match LRU + TTL cache of generated emails, scoped per user.
+
+    The key is a hash of the normalized prompt, tone, recipient, language and
+    style-profile version, so any change that would alter the output (a new
+    default tone, a freshly sent email updating the profile) misses the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: int = 600, enabled: bool = True):
+        self.enabled = enabled
+        self._entries: "TTLCache[Tuple[str, str], Dict[str, Any]]" = TTLCache(max_size, ttl_seconds)
+
+    def make_key(self, prompt: str, tone: str, recipient: str, language: str, style_version: int) -> str:
+        """Hash the request fields after normalizing case and whitespace."""
+        parts = [
+            " ".join(prompt.split()).casefold(),
+            (tone or "").strip().casefold(),
+            (recipient or "").strip().casefold(),
+            (language or "").strip().casefold(),
+            str(style_version),
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, user_id: Optional[str], key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        return self._entries.get((user_id or "", key))
+
+    def put(self, user_id: Optional[str], key: str, value: Dict[str, Any]):
+        if not self.enabled:
+            return
+
+        self._entries.put((user_id or "", key), value)
+
+    def invalidate_user(self, user_id: str):
+        """Drop every cached email for a user."""
+        self._entries.discard_where(lambda cache_key: cache_key[0] == user_id)
+
+
+# Global cache instance
+email_response_cache = EmailResponseCache(
+    max_size=settings.email_cache_size,
+    ttl_seconds=settings.email_cache_ttl_seconds,
+    enabled=settings.email_cache_enabled
+)
@@ -0,0 +1,96 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+from app.core.config import settings
+
+
+class StreamPacer:
+    """Coalesce streamed LLM deltas into fewer, larger frames.
+
+    The first delta is forwarded immediately so time-to-first-token is not
+    delayed. After that, deltas are merged until either ``window_ms`` has
+    passed or ``max_chars`` are pending. Upstream chunks keep being read while
+    the consumer is busy sending, so a slow socket receives larger merged
+    frames instead of stalling the generation. A window of 0 disables pacing
+    and passes chunks straight through.
+    """
+
+    def __init__(self, window_ms: int = 40, max_chars: int = 256):
+        self.window_ms = window_ms
+        self.max_chars = max_chars
+
+    async def pace(
+        self,
+        chunks: AsyncIterator[str],
+        window_ms: Optional[int] = None,
+        max_chars: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        window = (self.window_ms if window_ms is None else window_ms) / 1000
+        limit = self.max_chars if max_chars is None else max_chars
+
+        if window <= 0:
+            async for chunk in chunks:
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        pending: List[str] = []
+        state = {"size": 0, "done": False, "error": None}
+        arrived = asyncio.Event()
+
+        async def produce():
+            try:
+                async for chunk in chunks:
+                    pending.append(chunk)
+                    state["size"] += len(chunk)
+                    arrived.set()
+            except Exception as e:
+                state["error"] = e
+            finally:
+                state["done"] = True
+                arrived.set()
+
+        producer = asyncio.create_task(produce())
+        first = True
+        try:
+            while True:
+                if not pending and not state["done"]:
+                    arrived.clear()
+                    await arrived.wait()
+
+                if not first:
+                    deadline = loop.time() + window
+                    while not state["done"] and state["size"] < limit:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        arrived.clear()
+                        try:
+                            await asyncio.wait_for(arrived.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+
+                if pending:
+                    merged = "".join(pending)
+                    pending.clear()
+                    state["size"] = 0
+                    first = False
+                    yield merged
+
+                if state["done"] and not pending:
+                    break
+
+            if state["error"] is not None:
+                raise state["error"]
+        finally:
+            if not producer.done():
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+
+stream_pacer = StreamPacer(
+    window_ms=settings.stream_coalesce_window_ms,
+    max_chars=settings.stream_coalesce_max_chars
+)
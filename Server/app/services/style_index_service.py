@@ -0,0 +1,179 @@
+import asyncio
+import re
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import select
+from app.core.config import settings
+from app.core.database import db_manager, EmailMessageModel
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i i'm in is it its me my of on or our so "
+    "that the this to us was we were will with you your".split()
+)
+
+
+class HashingEmbedder:
+    """Local hashing-trick embedding of words and word bigrams.
+
+    No vocabulary and no external service: each token is hashed into a fixed
+    number of signed buckets, term counts are log-scaled and the vector is
+    L2-normalised so a dot product is the cosine similarity.
+    """
+
+    def __init__(self, dimensions: int = 4096):
+        self.dimensions = dimensions
+
+    def tokens(self, text: str) -> List[str]:
+        words = [w for w in TOKEN_PATTERN.findall(text.lower()) if w not in STOP_WORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in self.tokens(text):
+            digest = zlib.crc32(token.encode())
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimensions] += sign
+
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class UserStyleIndex:
+    """Sent emails of one user with their embeddings, newest last."""
+
+    def __init__(self, dimensions: int, max_entries: int, profile_version: int = 0):
+        self.max_entries = max_entries
+        self.profile_version = profile_version  # Style profile version the index was built at
+        self.email_ids: List[str] = []
+        self.entries: List[Tuple[str, str, str]] = []  # (to_email, subject, body)
+        self.matrix = np.zeros((0, dimensions), dtype=np.float32)
+
+    def add(self, email_id: str, to_email: str, subject: str, body: str, vector: np.ndarray):
+        if email_id in self.email_ids:
+            return
+        self.email_ids.append(email_id)
+        self.entries.append((to_email or "", subject, body))
+        self.matrix = np.vstack([self.matrix, vector[np.newaxis, :]])
+        if len(self.entries) > self.max_entries:
+            overflow = len(self.entries) - self.max_entries
+            del self.email_ids[:overflow]
+            del self.entries[:overflow]
+            self.matrix = self.matrix[overflow:]
+
+    def search(self, query: np.ndarray, recipient: str, k: int,
+               recipient_boost: float, min_score: float) -> List[Tuple[str, str]]:
+        if not self.entries or k <= 0:
+            return []
+
+        scores = self.matrix @ query
+        if recipient:
+            recipient = recipient.lower()
+            same_recipient = np.array([to.lower() == recipient for to, _, _ in self.entries])
+            scores = scores + recipient_boost * same_recipient
+
+        top = np.argsort(-scores)[:k]
+        return [(self.entries[i][1], self.entries[i][2]) for i in top if scores[i] >= min_score]
+
+
+class StyleIndexService:
+    """Per-user in-process similarity index over sent emails.
+
+    Indexes are built lazily from ``EmailMessageModel`` rows with status
+    ``sent`` the first time a user needs examples, then kept current by
+    ``add_email`` as further emails are sent. Each index records the style
+    profile version it was built at and is rebuilt once the caller's
+    version differs, so emails sent through another worker show up too.
+    The least recently used user indexes are dropped once ``max_users`` is
+    exceeded.
+    """
+
+    def __init__(self, dimensions: int = 4096, max_entries: int = 200, max_users: int = 1000,
+                 recipient_boost: float = 0.15, min_score: float = 0.1):
+        self.embedder = HashingEmbedder(dimensions)
+        self.max_entries = max_entries
+        self.max_users = max_users
+        self.recipient_boost = recipient_boost
+        self.min_score = min_score
+        self._indexes: "OrderedDict[str, UserStyleIndex]" = OrderedDict()
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+
+    def _document(self, subject: str, body: str) -> str:
+        return f"{subject}\n{body}"
+
+    def _store(self, user_id: str, index: UserStyleIndex):
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.max_users:
+            self._indexes.popitem(last=False)
+
+    def _current(self, index: Optional[UserStyleIndex], profile_version: Optional[int]) -> bool:
+        return index is not None and (profile_version is None or index.profile_version == profile_version)
+
+    async def get_index(self, user_id: str, profile_version: Optional[int] = None) -> UserStyleIndex:
+        """Return the user's index, rebuilding it when missing or built at another profile version."""
+        index = self._indexes.get(user_id)
+        if self._current(index, profile_version):
+            self._indexes.move_to_end(user_id)
+            return index
+
+        lock = self._build_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(user_id)
+            if not self._current(index, profile_version):
+                async with await db_manager.get_session() as db:
+                    result = await db.execute(
+                        select(
+                            EmailMessageModel.email_id,
+                            EmailMessageModel.to_email,
+                            EmailMessageModel.subject,
+                            EmailMessageModel.body
+                        )
+                        .where(
+                            EmailMessageModel.user_id == user_id,
+                            EmailMessageModel.status == "sent"
+                        )
+                        .order_by(EmailMessageModel.timestamp.desc())
+                        .limit(self.max_entries)
+                    )
+                    rows = list(reversed(result.all()))
+
+                index = UserStyleIndex(self.embedder.dimensions, self.max_entries, profile_version or 0)
+                for email_id, to_email, subject, body in rows:
+                    index.add(email_id, to_email, subject, body, self.embedder.embed(self._document(subject, body)))
+                self._store(user_id, index)
+        self._build_locks.pop(user_id, None)
+        return index
+
+    def add_email(self, user_id: str, email_id: str, to_email: str, subject: str, body: str,
+                  profile_version: Optional[int] = None):
+        """Add a newly sent email to the user's index, if it has been built.
+
+        ``profile_version`` is the style profile version after recording this
+        email. The index moves to it only when it was one version behind;
+        otherwise another worker recorded emails in between and the next
+        lookup rebuilds it.
+        """
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        index.add(email_id, to_email, subject, body, self.embedder.embed(self._document(subject, body)))
+        if profile_version is not None and index.profile_version == profile_version - 1:
+            index.profile_version = profile_version
+
+    async def top_k(self, user_id: str, prompt: str, recipient: str = "", k: int = 2,
+                    profile_version: Optional[int] = None) -> Tuple[Tuple[str, str], ...]:
+        """Return (subject, body) of the k sent emails most similar to this request."""
+        index = await self.get_index(user_id, profile_version)
+        query = self.embedder.embed(f"{recipient}\n{prompt}")
+        return tuple(index.search(query, recipient, k, self.recipient_boost, self.min_score))
+
+    def drop_user(self, user_id: str):
+        """Forget a user's index (e.g. after their email history is cleared)."""
+        self._indexes.pop(user_id, None)
+
+
+style_index_service = StyleIndexService(max_entries=settings.style_index_max_entries)
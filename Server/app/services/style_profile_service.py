@@ -0,0 +1,176 @@
+import re
+from typing import Optional, Dict, Any
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import UserStyleProfileModel, EmailMessageModel
+
+GREETING_PATTERN = re.compile(
+    r"^(dear|hi|hello|hey|greetings|good morning|good afternoon|good evening)\b(.*?)([,!:.]?)$",
+    re.IGNORECASE
+)
+CLOSING_PATTERN = re.compile(
+    r"^(best|kind|warm|warmest)?\s*(regards|wishes)|^(sincerely|thanks|thank you|cheers|warmly|"
+    r"respectfully|yours|take care|all the best|best)\b",
+    re.IGNORECASE
+)
+CONTRACTION_PATTERN = re.compile(r"\b\w+'(s|re|ve|ll|d|m|t)\b", re.IGNORECASE)
+SENTENCE_PATTERN = re.compile(r"[^.!?]+[.!?]+")
+
+MAX_PHRASES = 5
+
+
+class StyleProfileService:
+    """Maintains a compact, incrementally updated writing-style profile per user.
+
+    The profile is folded forward each time an email is marked as sent, so
+    prompt building only reads one small row instead of scanning past emails.
+    """
+
+    def analyze_email(self, subject: str, body: str) -> Dict[str, Any]:
+        """Extract style features from a single email."""
+        lines = [line.strip() for line in body.strip().splitlines() if line.strip()]
+        words = body.split()
+        sentences = SENTENCE_PATTERN.findall(body)
+        paragraphs = [p for p in re.split(r"\n\s*\n", body.strip()) if p.strip()]
+
+        greeting = None
+        if lines:
+            match = GREETING_PATTERN.match(lines[0])
+            if match and len(lines[0]) <= 60:
+                greeting = match.group(1).capitalize()
+                if match.group(2).strip():
+                    greeting += " {name}"
+                greeting += match.group(3)
+
+        closing = None
+        for line in reversed(lines[-4:]):
+            if len(line) <= 40 and CLOSING_PATTERN.match(line):
+                closing = line
+                break
+
+        return {
+            "greeting": greeting,
+            "closing": closing,
+            "words": len(words),
+            "paragraphs": len(paragraphs),
+            "sentence_words": len(words) / len(sentences) if sentences else len(words),
+            "contractions": len(CONTRACTION_PATTERN.findall(body)) * 100 / max(len(words), 1),
+            "exclamations": body.count("!"),
+            "subject_words": len(subject.split()),
+        }
+
+    def merge(self, profile: Dict[str, Any], sample_count: int, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Fold one email's features into an existing profile (running averages and counters)."""
+        profile = dict(profile or {})
+        n = sample_count + 1
+
+        for key in ("words", "paragraphs", "sentence_words", "contractions", "exclamations", "subject_words"):
+            average = profile.get(f"avg_{key}", 0.0)
+            profile[f"avg_{key}"] = average + (features[key] - average) / n
+
+        for key, feature in (("greetings", "greeting"), ("closings", "closing")):
+            counts = dict(profile.get(key, {}))
+            if features[feature]:
+                counts[features[feature]] = counts.get(features[feature], 0) + 1
+            # Keep only the most frequent phrases so the row stays small
+            profile[key] = dict(sorted(counts.items(), key=lambda item: -item[1])[:MAX_PHRASES])
+
+        return profile
+
+    def render(self, profile: Dict[str, Any], sample_count: int) -> str:
+        """Render a profile as a short prompt-ready description."""
+        if not profile or sample_count <= 0:
+            return ""
+
+        lines = []
+        greetings = list(profile.get("greetings", {}))
+        if greetings:
+            line = f"- Usual greeting: \"{greetings[0]}\""
+            if len(greetings) > 1:
+                line += f" (also: {', '.join(repr(g) for g in greetings[1:3])})"
+            lines.append(line)
+
+        closings = list(profile.get("closings", {}))
+        if closings:
+            lines.append(f"- Usual closing: \"{closings[0]}\"")
+
+        lines.append(
+            f"- Typical length: about {round(profile.get('avg_words', 0))} words "
+            f"in {max(1, round(profile.get('avg_paragraphs', 1)))} paragraphs"
+        )
+        lines.append(f"- Sentences average {round(profile.get('avg_sentence_words', 0))} words")
+
+        contractions = profile.get("avg_contractions", 0)
+        usage = "often" if contractions >= 2 else "sometimes" if contractions >= 0.5 else "rarely"
+        lines.append(f"- Uses contractions {usage}")
+
+        if profile.get("avg_exclamations", 0) >= 1:
+            lines.append("- Uses exclamation marks for warmth")
+
+        lines.append(f"- Subject lines are about {max(1, round(profile.get('avg_subject_words', 0)))} words")
+
+        return "\n".join(lines)
+
+    async def get_profile(self, db: AsyncSession, user_id: str) -> Optional[UserStyleProfileModel]:
+        result = await db.execute(
+            select(UserStyleProfileModel).where(UserStyleProfileModel.user_id == user_id)
+        )
+        return result.scalar_one_or_none()
+
+    async def record_sent_email(self, db: AsyncSession, user_id: str, subject: str, body: str) -> UserStyleProfileModel:
+        """Fold a newly sent email into the user's profile."""
+        profile = await self.get_profile(db, user_id)
+        if profile is None:
+            profile = UserStyleProfileModel(user_id=user_id, profile={}, sample_count=0, version=0)
+            db.add(profile)
+
+        profile.profile = self.merge(profile.profile, profile.sample_count or 0, self.analyze_email(subject, body))
+        profile.sample_count = (profile.sample_count or 0) + 1
+        profile.version = (profile.version or 0) + 1
+
+        await db.commit()
+        await db.refresh(profile)
+        return profile
+
+    async def rebuild_profile(self, db: AsyncSession, user_id: str, limit: int = 20) -> UserStyleProfileModel:
+        """Build a profile from existing sent emails (one-off backfill for users without one).
+
+        A user with no sent emails still gets a row, with an empty profile and
+        ``sample_count=0``, so the backfill query is not repeated on every load.
+        """
+        result = await db.execute(
+            select(EmailMessageModel.subject, EmailMessageModel.body)
+            .where(
+                EmailMessageModel.user_id == user_id,
+                EmailMessageModel.status == "sent"
+            )
+            .order_by(EmailMessageModel.timestamp.desc())
+            .limit(limit)
+        )
+        emails = list(reversed(result.all()))
+
+        data: Dict[str, Any] = {}
+        for count, (subject, body) in enumerate(emails):
+            data = self.merge(data, count, self.analyze_email(subject, body))
+
+        profile = await self.get_profile(db, user_id)
+        if profile is None:
+            profile = UserStyleProfileModel(user_id=user_id, version=0)
+            db.add(profile)
+        profile.profile = data
+        profile.sample_count = len(emails)
+        profile.version = (profile.version or 0) + 1
+
+        await db.commit()
+        await db.refresh(profile)
+        return profile
+
+    async def clear_profile(self, db: AsyncSession, user_id: str):
+        """Delete a user's style profile"""
+        await db.execute(
+            delete(UserStyleProfileModel).where(UserStyleProfileModel.user_id == user_id)
+        )
+        await db.commit()
+
+
+style_profile_service = StyleProfileService()
@@ -0,0 +1,59 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def hash_api_key(api_key: str) -> str:
+    """Fingerprint an API key so the raw value is never used as a cache key."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded LRU mapping whose entries also expire after a TTL.
+
+    Reads refresh an entry's recency but not its age. ``ttl_seconds`` is the
+    default lifetime; ``put`` may pass its own for entries that should expire
+    sooner or later.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[K, Tuple[V, float]]" = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        """Return a fresh value, dropping it if it has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V, ttl_seconds: Optional[float] = None):
+        """Store a value, evicting the least recently used entries over capacity."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard_where(self, predicate: Callable[[K], bool]):
+        """Drop every entry whose key matches, e.g. all of one user's entries."""
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
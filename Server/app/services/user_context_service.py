@@ -0,0 +1,111 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from sqlalchemy import select, and_
+
+from app.core.database import db_manager, UserModel, UserEnvironmentVariablesModel, UserStyleProfileModel
+from app.services.env_vars_service import env_vars_service
+from app.services.style_profile_service import style_profile_service
+from app.services.llm_service import GenerationContext, DEFAULT_CONTEXT
+
+
+@dataclass(frozen=True)
+class UserLLMContext:
+    """Everything needed before an LLM call for one user, loaded together."""
+    user_id: str
+    generation_context: GenerationContext = DEFAULT_CONTEXT
+    encrypted_api_key: Optional[str] = None
+    version: int = 0  # UserContextService.version() when loaded
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def api_key(self) -> Optional[str]:
+        """Decrypted GOOGLE_API_KEY, or None when the user has not stored one."""
+        if self.encrypted_api_key is None:
+            return None
+        return env_vars_service._decrypt_value(self.encrypted_api_key)
+
+    def is_stale(self, ttl_seconds: float) -> bool:
+        return time.monotonic() - self.loaded_at > ttl_seconds
+
+
+class UserContextService:
+    """Loads a user's preferences, encrypted API key and style profile in one query.
+
+    Code that changes any of those calls ``invalidate``, which bumps the user's
+    version so long-lived holders (WebSocket connections) know to reload.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+
+    def version(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def invalidate(self, user_id: str):
+        """Signal that the user's preferences, API key or style profile changed."""
+        self._versions[user_id] = self.version(user_id) + 1
+
+    def is_current(self, user_context: UserLLMContext) -> bool:
+        return user_context.version == self.version(user_context.user_id)
+
+    async def load(self, user_id: str) -> UserLLMContext:
+        """Load the user's LLM context with a single joined query.
+
+        The only other statement ever issued is a one-off backfill of the style
+        profile for AI-learning users who sent emails before profiles existed.
+        """
+        # Read the version first so a change made during the load still triggers a reload
+        context_version = self.version(user_id)
+        async with await db_manager.get_session() as db:
+            result = await db.execute(
+                select(
+                    UserModel.language,
+                    UserModel.default_tone,
+                    UserModel.ai_learning,
+                    UserEnvironmentVariablesModel.encrypted_value,
+                    UserStyleProfileModel.profile,
+                    UserStyleProfileModel.sample_count,
+                    UserStyleProfileModel.version
+                )
+                .select_from(UserModel)
+                .outerjoin(
+                    UserEnvironmentVariablesModel,
+                    and_(
+                        UserEnvironmentVariablesModel.user_id == UserModel.id,
+                        UserEnvironmentVariablesModel.key == "GOOGLE_API_KEY"
+                    )
+                )
+                .outerjoin(UserStyleProfileModel, UserStyleProfileModel.user_id == UserModel.id)
+                .where(UserModel.id == user_id)
+                .limit(1)
+            )
+            row = result.first()
+            if row is None:
+                return UserLLMContext(user_id=user_id, version=context_version)
+
+            language, default_tone, ai_learning, encrypted_api_key, profile, sample_count, version = row
+            if ai_learning and profile is None:
+                rebuilt = await style_profile_service.rebuild_profile(db, user_id)
+                profile, sample_count, version = rebuilt.profile, rebuilt.sample_count, rebuilt.version
+
+        style_profile = ""
+        if ai_learning and profile:
+            style_profile = style_profile_service.render(profile, sample_count or 0)
+
+        return UserLLMContext(
+            user_id=user_id,
+            generation_context=GenerationContext(
+                language=language or "English",
+                default_tone=default_tone or "Professional",
+                ai_learning=ai_learning or False,
+                style_profile=style_profile,
+                style_profile_version=version or 0
+            ),
+            encrypted_api_key=encrypted_api_key,
+            version=context_version
+        )
+
+
+# Global service instance
+user_context_service = UserContextService()
@@ -9,6 +9,8 @@ from websocket import websocket_endpoint
 from app.core.config import settings
 from app.api import logs, auth, env_vars, email_configs, chat_history, email_history
 from app.services.data_cleanup_service import data_cleanup_service
+from app.services.connection_manager import connection_manager
+from app.services.llm_scheduler import llm_scheduler
 
 app = FastAPI(
     title="MailAgent",
@@ -46,6 +48,14 @@ async def startup_event():
 async def root():
     return JSONResponse(content={"message": "Welcome to MailAgent API!"})
 
+@app.get("/api/ws/stats")
+async def websocket_stats():
+    """Connection and LLM queue counts for this worker, for metrics scraping"""
+    return JSONResponse(content={
+        "websocket": connection_manager.stats(),
+        "llm": llm_scheduler.stats()
+    })
+
 def main():
     print("Starting server with the following settings:")
     print(f"Host: {settings.host}")
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from app.services.email_stream_parser import DEFAULT_SUBJECT, EmailStreamParser
+
+SAMPLES = [
+    "Subject: Quarterly update\n\nDear team,\nNumbers are in.\n\nBest,\nHarshit Sharma",
+    "\n\n  Subject:   Lunch on Friday?  \nHi Sam,\nAre you free?\n",
+    "Project kickoff\nHello all,\nWe start Monday.",
+    "Dear Bob,\nThanks for the note.\nRegards",
+    "Hi,\nShort one.\nThird line.\nSubject: too late\nBody continues.",
+    "x" * 500 + "\nSubject: after the head window\nbody",
+    "Sub\nSubject: real\nbody",
+    "",
+]
+
+
+def parse(chunks):
+    parser = EmailStreamParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return parser.result("bob@example.com"), events
+
+
+def split_randomly(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 12)))) if len(text) > 1 else []
+    return [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_result_does_not_depend_on_chunk_boundaries(text):
+    whole, whole_events = parse([text])
+    rng = random.Random(text)
+    for _ in range(200):
+        result, events = parse(split_randomly(text, rng))
+        assert result == whole
+        assert [e for e in events if e[0] == "subject"] == [e for e in whole_events if e[0] == "subject"]
+        assert "".join(text for kind, text in events if kind == "body") == whole["email"]["body"]
+
+
+def test_subject_line_is_split_from_the_body():
+    result, _ = parse(["Subj", "ect: Hel", "lo\n\nDear Bob,\nBody."])
+    assert result["email"]["subject"] == "Hello"
+    assert result["email"]["body"] == "Dear Bob,\nBody."
+
+
+def test_subject_outside_the_head_window_stays_in_the_body():
+    result, _ = parse(list("Dear Sam,\nShort one.\nThird line.\nSubject: too late\nBody."))
+    assert result["email"]["subject"] == DEFAULT_SUBJECT
+    assert "Subject: too late" in result["email"]["body"]
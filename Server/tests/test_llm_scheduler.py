@@ -0,0 +1,86 @@
+import asyncio
+
+from app.services.llm_scheduler import LLMScheduler, TokenBucket
+
+
+def test_waiting_users_are_admitted_round_robin():
+    async def run():
+        scheduler = LLMScheduler(max_concurrent=1, max_concurrent_per_key=1, requests_per_minute=0)
+        blocker = scheduler.enqueue("key", "x")
+        tickets = {name: scheduler.enqueue("key", name[0]) for name in ("a1", "a2", "a3", "b1", "b2")}
+
+        order = []
+        current = blocker
+        while True:
+            current.release()
+            admitted = [name for name, ticket in tickets.items()
+                        if ticket.admitted.done() and name not in order]
+            if not admitted:
+                break
+            assert len(admitted) == 1
+            order.append(admitted[0])
+            current = tickets[admitted[0]]
+        return order
+
+    assert asyncio.run(run()) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_ticket_cancelled_while_queued_leaves_the_queue():
+    async def run():
+        scheduler = LLMScheduler(max_concurrent=1, max_concurrent_per_key=1, requests_per_minute=0)
+        first = scheduler.enqueue("key", "u1")
+        entered = []
+
+        async def worker():
+            async with scheduler.slot("key", "u2"):
+                entered.append(True)
+
+        task = asyncio.create_task(worker())
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 1
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert entered == []
+        assert scheduler.stats() == {"active": 1, "queued": 0, "queued_users": 0}
+
+        # The freed place goes to the next request, not the cancelled one
+        waiting = scheduler.enqueue("key", "u3")
+        first.release()
+        assert waiting.admitted.done()
+        waiting.release()
+        return scheduler.stats()
+
+    assert asyncio.run(run()) == {"active": 0, "queued": 0, "queued_users": 0}
+
+
+def test_token_bucket_refills_at_the_configured_rate():
+    bucket = TokenBucket(rate_per_minute=600, capacity=2)
+    assert bucket.try_take(bucket.updated_at)
+    now = bucket.updated_at
+    assert bucket.try_take(now)
+    assert not bucket.try_take(now)
+    assert abs(bucket.wait_time(now) - 0.1) < 1e-9
+    assert bucket.try_take(now + 0.1)
+
+
+def test_requests_over_the_rate_wait_for_a_token():
+    async def run():
+        scheduler = LLMScheduler(max_concurrent=10, max_concurrent_per_key=10,
+                                 requests_per_minute=600, burst=1)
+        loop = asyncio.get_running_loop()
+        first = scheduler.enqueue("key", "u1")
+        assert first.admitted.done()
+
+        started = loop.time()
+        second = scheduler.enqueue("key", "u1")
+        assert not second.admitted.done()
+        await asyncio.wait_for(second.admitted, 1)
+        elapsed = loop.time() - started
+
+        first.release()
+        second.release()
+        return elapsed
+
+    # One token every 0.1s at 600 requests per minute
+    assert asyncio.run(run()) >= 0.08
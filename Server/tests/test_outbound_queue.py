@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.services.outbound_queue import OutboundQueue, SlowConsumerError
+
+
+def test_deltas_merge_per_request_and_candidate():
+    async def run():
+        sent = []
+        gate = asyncio.Event()
+
+        async def send(frame):
+            await gate.wait()
+            sent.append(frame)
+
+        queue = OutboundQueue(send, max_frames=64, stall_timeout=1)
+        queue.start()
+        # The writer holds this frame until the gate opens, so the rest back up
+        await queue.put({"type": "stream_start", "request_id": "r"})
+        await asyncio.sleep(0)
+
+        deltas = [("r", 0, "A"), ("r", 0, "A2"), ("r", 1, "B"), ("r", 1, "B2"),
+                  ("r", 0, "a"), ("s", None, "x"), ("s", None, "y")]
+        for request_id, candidate, text in deltas:
+            frame = {"type": "stream_delta", "request_id": request_id, "delta": text}
+            if candidate is not None:
+                frame["candidate"] = candidate
+            await queue.put(frame)
+
+        gate.set()
+        await queue.close(flush_timeout=1)
+        return sent, deltas, queue.coalesced
+
+    sent, deltas, coalesced = asyncio.run(run())
+    frames = [f for f in sent if f["type"] == "stream_delta"]
+    assert coalesced == 3
+    assert len(frames) == len(deltas) - coalesced
+    for request_id, candidate in {(r, c) for r, c, _ in deltas}:
+        expected = "".join(text for r, c, text in deltas if (r, c) == (request_id, candidate))
+        got = "".join(f["delta"] for f in frames
+                      if f["request_id"] == request_id and f.get("candidate") == candidate)
+        assert got == expected
+
+
+def test_full_queue_raises_after_stall_timeout():
+    async def run():
+        async def stuck(frame):
+            await asyncio.sleep(100)
+
+        queue = OutboundQueue(stuck, max_frames=2, stall_timeout=0.05)
+        queue.start()
+        try:
+            with pytest.raises(SlowConsumerError):
+                for i in range(10):
+                    await queue.put({"type": "email", "request_id": str(i)})
+            assert queue.saturated and queue.closed
+
+            with pytest.raises(SlowConsumerError):
+                await queue.put({"type": "email", "request_id": "late"})
+        finally:
+            await queue.close()
+
+    asyncio.run(run())
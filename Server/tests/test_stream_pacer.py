@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.services.stream_pacer import StreamPacer
+
+
+def test_upstream_error_reaches_the_consumer():
+    async def upstream():
+        yield "a"
+        await asyncio.sleep(0.01)
+        yield "b"
+        raise ValueError("upstream failed")
+
+    async def run():
+        received = []
+        with pytest.raises(ValueError, match="upstream failed"):
+            async for chunk in StreamPacer(window_ms=20).pace(upstream()):
+                received.append(chunk)
+        return received
+
+    assert "".join(asyncio.run(run())) == "ab"
+
+
+def test_chunks_after_the_first_are_merged():
+    async def upstream():
+        for chunk in ["a", "b", "c", "d"]:
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def run():
+        return [chunk async for chunk in StreamPacer(window_ms=50).pace(upstream())]
+
+    frames = asyncio.run(run())
+    assert frames[0] == "a"
+    assert "".join(frames) == "abcd"
+    assert len(frames) < 4
+
+
+@pytest.mark.parametrize("stop", ["cancel", "aclose"])
+def test_stopping_the_consumer_closes_the_upstream(stop):
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            while True:
+                yield "x"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    async def run():
+        paced = StreamPacer(window_ms=20).pace(upstream())
+        if stop == "cancel":
+            async def consume():
+                async for _ in paced:
+                    pass
+
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            await paced.__anext__()
+            await paced.aclose()
+        return closed.is_set()
+
+    assert asyncio.run(run())
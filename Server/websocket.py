@@ -1,92 +1,425 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from app.api.chat import handle_chat_message, handle_email_request
+from starlette.websockets import WebSocketState
+from app.api.chat import handle_chat_message, handle_email_request, stream_chat_message, stream_email_request
 from app.services.user_activity_service import user_activity_service
 from app.models.schemas import ActivityAction, ActivityStatus
-from app.core.security import verify_token
+from app.services.user_context_service import user_context_service, UserLLMContext
+from app.services.connection_manager import connection_manager
+from app.services.conversation_memory import conversation_memory_service, ConversationMemory
+from app.services.outbound_queue import OutboundQueue, SlowConsumerError
+from app.core.security import decode_access_token
+from app.core.config import settings
+from typing import Dict, Optional, Set, Tuple
+import asyncio
 import time
+import uuid
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Opt-in binary framing: same message schema, encoded with MessagePack
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# Strong references to fire-and-forget tasks; the event loop only keeps weak ones
+background_tasks: Set[asyncio.Task] = set()
 
 class WebSocketHandler:
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
         self.session_id = f"ws_{int(time.time())}_{id(websocket)}"
         self.user_id = None
+        self.token_expires_at: Optional[float] = None
+        self.close_code = 1000
+        self.last_seen = time.monotonic()
+        # Clients opt in to server pings with ?heartbeat=1 and must answer with a pong
+        self.heartbeat = websocket.query_params.get("heartbeat") in ("1", "true")
+        self.use_msgpack = False
+        self.outbox = OutboundQueue(
+            self.send_frame,
+            max_frames=settings.ws_send_queue_max_frames,
+            stall_timeout=settings.ws_send_stall_timeout_seconds
+        )
+        self.evicting = False
+        self.user_context: Optional[UserLLMContext] = None
+        self.memory: Optional[ConversationMemory] = None
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.inflight = asyncio.Semaphore(settings.ws_max_inflight_per_connection)
 
-    async def connect(self):
-        await self.websocket.accept()
+    async def connect(self, subprotocol: Optional[str] = None):
+        await self.websocket.accept(subprotocol=subprotocol)
+        self.outbox.start()
+
+    async def send(self, frame: dict):
+        """Queue a frame for this connection's writer task."""
+        try:
+            await self.outbox.put(frame)
+        except SlowConsumerError as e:
+            if self.outbox.saturated and not self.evicting:
+                # Evict from a separate task: eviction cancels this request's task too
+                self.evicting = True
+                task = asyncio.create_task(connection_manager.evict(self, str(e)))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+            raise WebSocketDisconnect(code=1013)
 
     async def disconnect(self):
-        await self.websocket.close()
+        # Let already queued frames (e.g. a final error) go out, unless the client stopped reading
+        await self.outbox.close(flush_timeout=0 if self.outbox.saturated else 1.0)
+        if self.websocket.application_state != WebSocketState.DISCONNECTED:
+            try:
+                await self.websocket.close(code=self.close_code)
+            except RuntimeError:
+                # The client already went away
+                pass
+
+    def handshake_credentials(self) -> Tuple[Optional[str], Optional[str]]:
+        """Return the token sent at connect time and the subprotocol to accept.
+
+        The token comes from the ``token`` query parameter, or from a
+        ``["bearer", "<jwt>"]`` subprotocol pair for clients that cannot put it
+        in the URL. Offering "msgpack" (when the package is installed) switches
+        the connection to MessagePack frames and is the accepted subprotocol;
+        otherwise "bearer" is accepted if offered.
+        """
+        token = self.websocket.query_params.get("token")
+        subprotocols = self.websocket.scope.get("subprotocols", [])
+        subprotocol = None
+        if "bearer" in subprotocols:
+            index = subprotocols.index("bearer")
+            if index + 1 < len(subprotocols):
+                token = token or subprotocols[index + 1]
+            subprotocol = "bearer"
+        if msgpack is not None and MSGPACK_SUBPROTOCOL in subprotocols:
+            self.use_msgpack = True
+            subprotocol = MSGPACK_SUBPROTOCOL
+        return token, subprotocol
+
+    async def receive(self) -> dict:
+        """Read the next client message in the negotiated encoding."""
+        if self.use_msgpack:
+            message = msgpack.unpackb(await self.websocket.receive_bytes(), raw=False)
+            if not isinstance(message, dict):
+                raise ValueError("Expected a MessagePack map")
+            return message
+        return await self.websocket.receive_json()
+
+    async def send_frame(self, frame: dict):
+        """Write one frame to the socket in the negotiated encoding (used by the outbox writer)."""
+        if self.use_msgpack:
+            await self.websocket.send_bytes(msgpack.packb(frame, use_bin_type=True))
+        else:
+            await self.websocket.send_json(frame)
+
+    def authenticate(self, token: Optional[str]) -> bool:
+        """Bind this connection to the token's user if the token is valid and unexpired."""
+        payload = decode_access_token(token) if token else None
+        if not payload or not payload.get("sub"):
+            return False
+        self.user_id = payload["sub"]
+        self.token_expires_at = payload.get("exp")
+        return True
+
+    def session_expired(self) -> bool:
+        return self.token_expires_at is not None and time.time() >= self.token_expires_at
+
+    async def send_error(self, request_id: Optional[str], status: int, content: str):
+        await self.send({
+            "type": "error",
+            "status": status,
+            "request_id": request_id,
+            "role": "assistant",
+            "content": content,
+            "timestamp": int(time.time())
+        })
+
+    async def get_user_context(self) -> Optional[UserLLMContext]:
+        """Return this connection's user context, reloading it after a change signal.
+
+        The TTL is only a backstop for changes made through another worker process.
+        """
+        if not self.user_id:
+            return None
+
+        if (
+            self.user_context is None
+            or not user_context_service.is_current(self.user_context)
+            or self.user_context.is_stale(settings.ws_user_context_ttl_seconds)
+        ):
+            try:
+                self.user_context = await user_context_service.load(self.user_id)
+            except Exception as e:
+                # Leave it to the request path to retry and report the failure
+                print(f"Failed to load user context: {e}")
+                self.user_context = None
+        return self.user_context
+
+    async def load_memory(self, pending_content: str = ""):
+        """Seed this connection's chat memory from saved history once it is authenticated.
+
+        ``pending_content`` is a message that arrived together with the token. The
+        client saves messages before sending them, so it may already be in the history.
+        """
+        self.memory = await conversation_memory_service.load(self.user_id)
+        if self.memory is not None and pending_content:
+            self.memory.discard_trailing_user_turn(pending_content)
+
+    def get_request_id(self, data: dict) -> str:
+        """Use the client's request id for frame correlation, or assign one."""
+        return str(data.get("request_id") or uuid.uuid4().hex)
+
+    async def dispatch(self, data: dict):
+        """Run a request as its own task so one client can pipeline chat and email work.
+
+        Up to ``ws_max_inflight_per_connection`` requests run at once; the rest
+        wait their turn, and beyond ``ws_max_pending_per_connection`` new
+        requests are rejected. Responses carry the request id, not arrival order.
+        """
+        request_id = data["request_id"] = self.get_request_id(data)
+        if request_id in self.tasks:
+            # Frames and cancels are keyed by request id, so two live requests must not share one
+            await self.send({
+                "type": "rejected",
+                "request_id": request_id,
+                "role": "assistant",
+                "content": "A request with this id is already in progress.",
+                "timestamp": int(time.time())
+            })
+            return
+
+        if len(self.tasks) >= settings.ws_max_pending_per_connection:
+            await self.send({
+                "type": "rejected",
+                "request_id": request_id,
+                "role": "assistant",
+                "content": "Too many requests in progress. Please wait for one to finish.",
+                "timestamp": int(time.time())
+            })
+            return
+
+        task = asyncio.create_task(self.run_request(data))
+        self.tasks[request_id] = task
+        task.add_done_callback(lambda _: self.forget_task(request_id, task))
+
+    def forget_task(self, request_id: str, task: asyncio.Task):
+        if self.tasks.get(request_id) is task:
+            del self.tasks[request_id]
+
+    async def run_request(self, data: dict):
+        try:
+            async with self.inflight:
+                if data.get("type", "chat") == "email":
+                    await self.handle_email(data)
+                else:
+                    await self.handle_message(data)
+        except WebSocketDisconnect:
+            # The receive loop notices the disconnect and cancels the rest
+            pass
+        except Exception as e:
+            print(f"WebSocket request error: {e}")
+
+    async def cancel(self, request_id: Optional[str]):
+        """Stop a request and its upstream generation, then acknowledge."""
+        task = self.tasks.get(str(request_id)) if request_id else None
+        if task is not None:
+            task.cancel()
+        await self.send({
+            "type": "cancelled",
+            "request_id": request_id,
+            "found": task is not None
+        })
+
+    async def cancel_all(self):
+        """Cancel every outstanding request, e.g. once the client has gone away."""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def handle_message(self, data: dict):
+        if data.get("stream"):
+            await self.stream_message(data)
+            return
+
+        try:
+            response = await handle_chat_message(
+                data, user_id=self.user_id, user_context=await self.get_user_context(),
+                memory=self.memory
+            )
+            await self.send({**response.model_dump(), "request_id": data["request_id"]})
+        except Exception as e:
+            await self.send({
+                "request_id": data["request_id"],
+                "role": "assistant",
+                "content": "The message request could not be processed.",
+                "timestamp": int(time.time())
+            })
+
+    async def stream_message(self, data: dict):
+        request_id = self.get_request_id(data)
         try:
-            response = await handle_chat_message(data, user_id=self.user_id)
-            await self.websocket.send_json(response.model_dump())
+            async for frame in stream_chat_message(
+                data, request_id, user_id=self.user_id, user_context=await self.get_user_context(),
+                memory=self.memory
+            ):
+                await self.send(frame)
+        except WebSocketDisconnect:
+            raise
         except Exception as e:
-            await self.websocket.send_json({
+            await self.send({
+                "type": "stream_error",
+                "request_id": request_id,
                 "role": "assistant",
                 "content": "The message request could not be processed.",
                 "timestamp": int(time.time())
             })
 
     async def handle_email(self, data: dict):
+        if data.get("stream"):
+            await self.stream_email(data)
+            return
+
         try:
-            response = await handle_email_request(data, user_id=self.user_id)
-            await self.websocket.send_json(response)
-            
-            # Log email generation activity
-            if self.user_id:
-                await user_activity_service.log_activity(
-                    user_id=self.user_id,
-                    action=ActivityAction.EMAIL_GENERATED,
-                    status=ActivityStatus.SUCCESS,
-                    message="Email generated successfully",
-                    details={
-                        "recipient": data.get("receiverEmail", ""),
-                        "tone": data.get("tone", "")
-                    }
-                )
+            response = await handle_email_request(
+                data, user_id=self.user_id, user_context=await self.get_user_context()
+            )
+            served_by = response.pop("served_by", None)
+            await self.send({**response, "request_id": data["request_id"]})
+            await self.log_email_generated(data, served_by)
         except Exception as e:
-            # Log email generation error
-            if self.user_id:
-                await user_activity_service.log_activity(
-                    user_id=self.user_id,
-                    action=ActivityAction.EMAIL_GENERATED,
-                    status=ActivityStatus.ERROR,
-                    message="Failed to generate email",
-                    details={"error": str(e)}
-                )
-            
-            await self.websocket.send_json({
+            await self.log_email_failed(e)
+
+            await self.send({
+                "request_id": data["request_id"],
+                "role": "assistant",
+                "content": "The email request could not be processed.",
+                "timestamp": int(time.time())
+            })
+
+    async def stream_email(self, data: dict):
+        request_id = self.get_request_id(data)
+        served_by = None
+        try:
+            async for frame in stream_email_request(
+                data, request_id, user_id=self.user_id, user_context=await self.get_user_context()
+            ):
+                if frame.get("type") == "email":
+                    frame = dict(frame)
+                    served_by = frame.pop("served_by", None)
+                await self.send(frame)
+            await self.log_email_generated(data, served_by)
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            await self.log_email_failed(e)
+
+            await self.send({
+                "type": "stream_error",
+                "request_id": request_id,
                 "role": "assistant",
                 "content": "The email request could not be processed.",
                 "timestamp": int(time.time())
             })
 
+    async def log_email_generated(self, data: dict, served_by: Optional[str] = None):
+        # Log email generation activity, including which key (or the cache) served it
+        if self.user_id:
+            await user_activity_service.log_activity(
+                user_id=self.user_id,
+                action=ActivityAction.EMAIL_GENERATED,
+                status=ActivityStatus.SUCCESS,
+                message="Email generated successfully",
+                details={
+                    "recipient": data.get("receiverEmail", ""),
+                    "tone": data.get("tone", ""),
+                    "served_by": served_by
+                }
+            )
+
+    async def log_email_failed(self, error: Exception):
+        # Log email generation error
+        if self.user_id:
+            await user_activity_service.log_activity(
+                user_id=self.user_id,
+                action=ActivityAction.EMAIL_GENERATED,
+                status=ActivityStatus.ERROR,
+                message="Failed to generate email",
+                details={"error": str(error)}
+            )
+
 async def websocket_endpoint(websocket: WebSocket):
     handler = WebSocketHandler(websocket)
-    authenticated_user = None
-    
+
+    # Authenticate during the handshake; a bad or expired token never gets a socket
+    token, subprotocol = handler.handshake_credentials()
+    if token and not handler.authenticate(token):
+        await websocket.close(code=4401)
+        return
+
+    if not connection_manager.has_capacity():
+        await websocket.close(code=1013)  # Try again later
+        return
+    if handler.user_id and not connection_manager.bind_user(handler):
+        await websocket.close(code=4429)
+        return
+
+    connection_manager.register(handler)
+    monitor = None
     try:
-        await handler.connect()
+        await handler.connect(subprotocol)
+        monitor = asyncio.create_task(connection_manager.monitor(handler))
+        if handler.user_id:
+            # Load preferences, the API key and chat memory once for the whole connection
+            await handler.get_user_context()
+            await handler.load_memory()
+
         while True:
-            data = await websocket.receive_json()
-            
-            # Check for authentication token in the message
-            token = data.get("token")
-            if token and not authenticated_user:
-                user_id = verify_token(token)
-                if user_id:
-                    authenticated_user = user_id
-                    handler.user_id = user_id  # Store user_id in handler
-            
+            data = await handler.receive()
+            handler.last_seen = time.monotonic()
+
             message_type = data.get("type", "chat")
-            if message_type == "email":
-                await handler.handle_email(data)
+            if message_type == "ping":
+                await handler.send({"type": "pong", "timestamp": int(time.time())})
+                continue
+            if message_type == "pong":
+                continue
+
+            # Older clients send the token inside their first message instead
+            if not handler.user_id and data.get("token"):
+                if handler.authenticate(data["token"]):
+                    if not connection_manager.bind_user(handler):
+                        await handler.send_error(
+                            data.get("request_id"), 429, "Too many open connections for this account."
+                        )
+                        handler.close_code = 4429
+                        break
+                    await handler.get_user_context()
+                    await handler.load_memory(data.get("content", ""))
+
+            if handler.session_expired():
+                await handler.send_error(
+                    data.get("request_id"), 401, "Your session has expired. Please sign in again."
+                )
+                handler.close_code = 4401
+                break
+
+            if message_type == "cancel":
+                await handler.cancel(data.get("request_id"))
+            elif not handler.user_id:
+                # No LLM work for unauthenticated sockets
+                await handler.send_error(data.get("request_id"), 401, "Please sign in to use the assistant.")
             else:
-                await handler.handle_message(data)
+                await handler.dispatch(data)
     except WebSocketDisconnect:
         pass
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
-        await handler.disconnect()
\ No newline at end of file
+        if monitor is not None:
+            monitor.cancel()
+        connection_manager.unregister(handler)
+        # Tear down any generation still running for this connection
+        await handler.cancel_all()
+        await handler.disconnect()